@@ -0,0 +1,405 @@
+# 離線效能測試：以模擬的 Telegram 客戶端與本機 ImgBB 替身執行 everypy.main / hispy.main，
+# 不需要任何憑證或網路，可在 CI 中比較每次修改前後的吞吐量、記憶體與各階段耗時。
+#
+# 用法：
+#   python benchmark.py --target everypy --sizes 100,1000,10000
+#   python benchmark.py --target hispy --sizes 1000000 --photo-ratio 0
+#   python benchmark.py --sizes 1000 --flood-every 50 --output bench.json --min-msgs-per-sec 200
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+# 模擬訊息文本使用的字元（節錄自頻道內容），讓搜尋索引的詞數接近真實資料
+CJK_TEXT_POOL = "濟公報聖賢語錄人生進入哪個階段還有多少歲月可用觀水逝去一流不回頭反觀自己生命河流過了匆匆無情等待事情若做得完整我們的心反而更亂能一件點滴去吸收化解行持就有辦法持續成長"
+
+# --- 模擬資料 ---
+def build_base_photo(long_side: int) -> bytes:
+    """產生一張指定長邊像素的 JPEG。使用雜訊圖案，壓縮後的大小接近真實照片。"""
+    from PIL import Image
+
+    width, height = long_side, max(1, long_side * 3 // 4)
+    image = Image.effect_noise((width, height), 48).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+class FakeTelegramClient:
+    """
+    模擬 Telethon 客戶端中爬蟲會用到的部分：get_me、get_entity、get_messages、iter_messages 與 download_media。
+    訊息 ID 為 1..message_count，依 ID 以固定間隔排列日期，最後一則訊息是現在；訊息在需要時才產生，
+    因此可以模擬一百萬則訊息而不佔用大量記憶體。
+    每次請求（iter_messages 每頁 100 則、每次下載）都會等待設定的延遲，並可每隔 flood_every 次請求觸發一次 FloodWait。
+    """
+
+    PAGE_SIZE = 100
+
+    def __init__(self, message_count: int, photo_ratio: float, photo_bytes: bytes, text_length: int,
+                 interval_seconds: float, telegram_latency: float, download_latency: float,
+                 flood_every: int = 0, flood_seconds: int = 1):
+        self.message_count = message_count
+        self.photo_ratio = photo_ratio
+        self.photo_bytes = photo_bytes
+        self.text_length = text_length
+        self.interval = interval_seconds
+        self.telegram_latency = telegram_latency
+        self.download_latency = download_latency
+        self.flood_every = flood_every
+        self.flood_seconds = flood_seconds
+        self.flood_sleep_threshold = 60
+        self.end_timestamp = time.time() - 60
+        self.request_count = 0
+        self.flood_wait_count = 0
+        self.download_count = 0
+
+    # --- 訊息產生 ---
+    def _timestamp(self, msg_id: int) -> float:
+        return self.end_timestamp - (self.message_count - msg_id) * self.interval
+
+    def _first_id_after(self, date: datetime) -> int:
+        position = (date.timestamp() - self.end_timestamp) / self.interval + self.message_count
+        return max(1, math.floor(position) + 1)
+
+    def _last_id_before(self, date: datetime) -> int:
+        position = (date.timestamp() - self.end_timestamp) / self.interval + self.message_count
+        return min(self.message_count, math.ceil(position) - 1)
+
+    def _has_photo(self, msg_id: int) -> bool:
+        return (msg_id * 2654435761) % 1000 < self.photo_ratio * 1000
+
+    def _message(self, msg_id: int):
+        body = "".join(CJK_TEXT_POOL[(msg_id * 7 + i * 13) % len(CJK_TEXT_POOL)] for i in range(self.text_length))
+        photo = None
+        if self._has_photo(msg_id):
+            photo = SimpleNamespace(id=10**9 + msg_id, access_hash=msg_id * 31)
+        return SimpleNamespace(
+            id=msg_id,
+            date=datetime.fromtimestamp(self._timestamp(msg_id), tz=timezone.utc),
+            edit_date=None,
+            text=f"濟公報  ～聖賢語錄\n第{msg_id}篇\n{body}",
+            photo=photo,
+        )
+
+    async def _request(self, latency: float):
+        from telethon.errors import FloodWaitError
+
+        self.request_count += 1
+        if self.flood_every and self.request_count % self.flood_every == 0:
+            self.flood_wait_count += 1
+            raise FloodWaitError(request=None, capture=self.flood_seconds)
+        if latency:
+            await asyncio.sleep(latency)
+
+    # --- Telethon 介面 ---
+    async def get_me(self):
+        return SimpleNamespace(first_name="Benchmark", last_name=None, id=0)
+
+    async def get_entity(self, entity):
+        return entity
+
+    async def get_messages(self, entity, limit=None, ids=None, offset_date=None, **kwargs):
+        if ids is not None:
+            await self._request(self.telegram_latency)
+            return [self._message(msg_id) if 1 <= msg_id <= self.message_count else None for msg_id in ids]
+        return [msg async for msg in self.iter_messages(entity, limit=limit, offset_date=offset_date, **kwargs)]
+
+    async def iter_messages(self, entity, limit=None, offset_date=None, reverse=False,
+                            min_id=0, max_id=0, offset_id=0, wait_time=None, **kwargs):
+        # 與 Telethon 相同：min_id/max_id/offset_id 不包含本身；reverse=True 時由舊到新
+        low = max(1, min_id + 1)
+        high = min(self.message_count, max_id - 1) if max_id else self.message_count
+        if reverse:
+            if offset_id:
+                low = max(low, offset_id + 1)
+            if offset_date:
+                low = max(low, self._first_id_after(offset_date))
+            ids = range(low, high + 1)
+        else:
+            if offset_id:
+                high = min(high, offset_id - 1)
+            if offset_date:
+                high = min(high, self._last_id_before(offset_date))
+            ids = range(high, low - 1, -1)
+
+        for count, msg_id in enumerate(ids):
+            if limit is not None and count >= limit:
+                return
+            if count % self.PAGE_SIZE == 0:
+                await self._request(self.telegram_latency)
+            yield self._message(msg_id)
+
+    async def download_media(self, media, file=None, **kwargs):
+        # 在 JPEG 結尾後附加圖片 ID，讓每張圖片的內容雜湊都不同（解碼器會忽略結尾後的資料）
+        content = self.photo_bytes + str(media.id).encode()
+        # 與 Telethon 相同，分成兩個 GetFile 請求、每收到一段就寫入；第二段遇到 FloodWait 時前半段已經寫入 file
+        half = len(content) // 2
+        await self._request(self.download_latency)
+        file.write(content[:half])
+        await self._request(0)
+        file.write(content[half:])
+        self.download_count += 1
+        return file
+
+
+class FakeImgBBServer:
+    """
+    本機的 ImgBB 替身：/1/upload 回傳與 ImgBB 相同格式的結果，/notify 代替推播通知後端。
+    在獨立的執行緒與事件循環中執行，爬蟲中同步的 requests.post 才不會卡住替身本身。
+    """
+
+    def __init__(self, upload_latency: float, fail_every: int = 0, photo_bytes: bytes = b""):
+        self.upload_latency = upload_latency
+        self.fail_every = fail_every # 每隔多少次上傳請求回傳一次 503，用於測量重試
+        self.photo_bytes = photo_bytes # 模擬圖片的內容，用於檢查上傳的原圖是否完整
+        self.stats = {"uploads": 0, "upload_bytes": 0, "upload_errors": 0, "corrupt_uploads": 0, "notifications": 0}
+        self._requests = 0
+        self.base_url = None
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    def start(self):
+        import threading
+
+        ready = threading.Event()
+
+        def serve():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self._start_app())
+            ready.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self._runner.cleanup())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=serve, daemon=True)
+        self._thread.start()
+        ready.wait()
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    async def _start_app(self):
+        from aiohttp import web
+        from image_variants import IMAGE_VARIANT_SIZES
+
+        async def upload(request):
+            data = await request.post()
+            image = data["image"]
+            self._requests += 1
+            if self.fail_every and self._requests % self.fail_every == 0:
+                self.stats["upload_errors"] += 1
+                return web.json_response({"success": False, "error": {"message": "benchmark"}}, status=503)
+            self.stats["uploads"] += 1
+            content = image.file.read()
+            self.stats["upload_bytes"] += len(content)
+            # 原圖應為模擬圖片加上 10 位數的圖片 ID；縮圖版本 (_thumb/_medium) 經過重新編碼，不檢查
+            is_original = not os.path.splitext(image.filename)[0].endswith(tuple(f"_{name}" for name in IMAGE_VARIANT_SIZES))
+            if is_original and (not content.startswith(self.photo_bytes) or len(content) != len(self.photo_bytes) + 10):
+                self.stats["corrupt_uploads"] += 1
+            if self.upload_latency:
+                await asyncio.sleep(self.upload_latency)
+            return web.json_response({"success": True, "data": {"url": f"https://i.ibb.co/benchmark/{image.filename}"}})
+
+        async def notify(request):
+            self.stats["notifications"] += 1
+            return web.json_response({})
+
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/1/upload", upload)
+        app.router.add_post("/notify", notify)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}"
+
+
+# --- 執行單一情境 ---
+async def run_scenario(args, message_count: int) -> dict:
+    # everypy 在執行時檢查環境變數，並在匯入時讀取調校參數，因此先設定假的憑證與參數，並在暫存目錄中匯入
+    os.environ.update({
+        "TELEGRAM_API_ID": "1",
+        "TELEGRAM_API_HASH": "benchmark",
+        "IMGBB_API_KEY": "benchmark",
+        "CHANNEL_USERNAME": "benchmark",
+        "BACKFILL_CONCURRENCY": str(args.backfill_concurrency),
+        "ENABLE_IMAGE_VARIANTS": "0" if args.no_image_variants else "1",
+        "IMAGE_STORAGE": args.image_storage,
+        "UPLOAD_BACKOFF_BASE": "0.05", # 重試退避縮短，避免等待時間蓋過實際的處理耗時
+    })
+    os.environ.pop("TELETHON_SESSION", None)
+
+    import post_store
+
+    photo_bytes = build_base_photo(args.photo_size) if args.photo_ratio > 0 else b""
+    client = FakeTelegramClient(
+        message_count, args.photo_ratio, photo_bytes, args.text_length, args.interval_seconds,
+        args.telegram_latency, args.download_latency, args.flood_every, args.flood_seconds,
+    )
+    imgbb = FakeImgBBServer(args.upload_latency, args.upload_fail_every, photo_bytes)
+    imgbb.start()
+    log = sys.stdout if args.verbose else open(os.devnull, "w", encoding="utf-8")
+    started = time.perf_counter()
+    try:
+        with redirect_stdout(log):
+            if args.target == "everypy":
+                import everypy
+
+                everypy.client = client
+                everypy.IMGBB_UPLOAD_URL = f"{imgbb.base_url}/1/upload"
+                everypy.NOTIFICATION_URL = f"{imgbb.base_url}/notify"
+                everypy.NOTIFICATION_DELAY_SECONDS = 0
+                # 空的工作目錄沒有高水位線，增量模式會處理整個模擬頻道
+                await everypy.main(incremental=True)
+                metrics_file = everypy.METRICS_FILE
+            else:
+                import hispy
+
+                await hispy.main(client, "benchmark")
+                metrics_file = hispy.METRICS_FILE
+    finally:
+        elapsed = time.perf_counter() - started
+        imgbb.stop()
+        if log is not sys.stdout:
+            log.close()
+
+    with post_store.PostStore(post_store.POST_STORE_FILE, bootstrap_json=None) as store:
+        stored_posts = store.count()
+
+    # 各階段耗時與計數器取自爬蟲本身輸出的執行指標
+    with open(metrics_file, "r", encoding="utf-8") as f:
+        crawler_metrics = json.load(f)
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "target": args.target,
+        "messages": message_count,
+        "stored_posts": stored_posts,
+        "photos": client.download_count,
+        "seconds": round(elapsed, 3),
+        "msgs_per_sec": round(message_count / elapsed, 1) if elapsed else None,
+        # Linux 的 ru_maxrss 單位為 KB
+        "peak_rss_mb": round(self_usage.ru_maxrss / 1024, 1),
+        "peak_children_rss_mb": round(children_usage.ru_maxrss / 1024, 1),
+        "telegram_requests": client.request_count,
+        "flood_waits": client.flood_wait_count,
+        # 任一儲存後端成功儲存的圖片數與位元組數（取自爬蟲的計數器）
+        "uploads": crawler_metrics["counters"].get("images_uploaded", 0),
+        "upload_mb": round(crawler_metrics["counters"].get("bytes_uploaded", 0) / 1024 / 1024, 2),
+        "upload_errors": imgbb.stats["upload_errors"],
+        # 內容與下載的圖片不一致的原圖（例如重試下載時殘留了前一次的部分內容），應為 0
+        "corrupt_uploads": imgbb.stats["corrupt_uploads"],
+        # 各階段的累計耗時；並行執行的階段可能加總超過總耗時
+        "stages": {name: stage["seconds"] for name, stage in crawler_metrics["stages"].items()},
+        "counters": crawler_metrics["counters"],
+        "histograms": {
+            name: {key: histogram[key] for key in ("count", "p50", "p90", "p99", "max")}
+            for name, histogram in crawler_metrics["histograms"].items()
+        },
+    }
+
+
+# --- 命令列 ---
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="以模擬的 Telegram 與 ImgBB 離線測量爬蟲效能")
+    parser.add_argument("--target", choices=["everypy", "hispy"], default="everypy",
+                        help="要測試的流程：everypy（每日爬取與圖片管線）或 hispy（歷史回補）")
+    parser.add_argument("--sizes", default="1000", help="模擬頻道的訊息數量，以逗號分隔，例如 100,10000,1000000")
+    parser.add_argument("--photo-ratio", type=float, default=1.0, help="含圖片的訊息比例 (0~1)")
+    parser.add_argument("--photo-size", type=int, default=1280, help="模擬圖片的長邊像素")
+    parser.add_argument("--text-length", type=int, default=80, help="每則訊息附加的文字長度")
+    parser.add_argument("--interval-seconds", type=float, default=600, help="相鄰訊息的時間間隔（秒）")
+    parser.add_argument("--telegram-latency", type=float, default=0.02, help="每次取得訊息頁面的延遲（秒）")
+    parser.add_argument("--download-latency", type=float, default=0.02, help="每次下載圖片的延遲（秒）")
+    parser.add_argument("--upload-latency", type=float, default=0.05, help="每次上傳到 ImgBB 替身的延遲（秒）")
+    parser.add_argument("--flood-every", type=int, default=0, help="每隔多少次 Telegram 請求觸發一次 FloodWait，0 為不觸發")
+    parser.add_argument("--flood-seconds", type=int, default=1, help="FloodWait 要求等待的秒數")
+    parser.add_argument("--upload-fail-every", type=int, default=0,
+                        help="ImgBB 替身每隔多少次上傳回傳一次 503（測量重試），0 為不失敗")
+    parser.add_argument("--no-image-variants", action="store_true", help="停用縮圖版本，只測量下載與上傳原圖")
+    parser.add_argument("--image-storage", choices=["imgbb", "local"], default="imgbb",
+                        help="everypy 的圖片儲存後端：imgbb（本機替身）或 local（寫入暫存目錄的 images/）")
+    parser.add_argument("--backfill-concurrency", type=int, default=4, help="hispy 同時抓取的區段數量")
+    parser.add_argument("--output", help="將結果寫入 JSON 檔案")
+    parser.add_argument("--min-msgs-per-sec", type=float,
+                        help="任一情境低於此吞吐量時以非零狀態碼結束，用於 CI 的效能回歸檢查")
+    parser.add_argument("--verbose", action="store_true", help="顯示爬蟲本身的輸出")
+    parser.add_argument("--child-result", help=argparse.SUPPRESS) # 內部使用：在子行程中執行單一情境
+    return parser.parse_args(argv)
+
+
+def run_child(args):
+    """在新的暫存目錄中執行一個情境，結果寫入 --child-result。"""
+    message_count = int(args.sizes)
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, repo_dir)
+    with tempfile.TemporaryDirectory(prefix="jigong-bench-") as work_dir:
+        os.chdir(work_dir)
+        result = asyncio.run(run_scenario(args, message_count))
+        os.chdir(repo_dir)
+    with open(args.child_result, "w", encoding="utf-8") as f:
+        json.dump(result, f)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    args = parse_args(argv)
+    if args.child_result:
+        run_child(args)
+        return 0
+
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    results = []
+    for size in sizes:
+        # 每個情境在獨立的子行程中執行，峰值記憶體 (peak RSS) 才不會互相影響
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+            result_path = f.name
+        child_argv = [arg for arg in argv if not arg.startswith("--sizes")]
+        if "--sizes" in argv:
+            index = argv.index("--sizes")
+            child_argv = argv[:index] + argv[index + 2:]
+        command = [sys.executable, os.path.abspath(__file__), *child_argv, "--sizes", str(size), "--child-result", result_path]
+        print(f"正在執行 {args.target}，{size} 則訊息...", flush=True)
+        completed = subprocess.run(command)
+        if completed.returncode != 0:
+            print(f"錯誤：{size} 則訊息的情境執行失敗 (狀態碼 {completed.returncode})。")
+            return completed.returncode
+        with open(result_path, "r", encoding="utf-8") as f:
+            results.append(json.load(f))
+        os.remove(result_path)
+
+    print()
+    print(f"{'訊息數':>10} {'秒數':>10} {'訊息/秒':>10} {'峰值RSS(MB)':>12} {'圖片':>8} {'上傳':>8} {'FloodWait':>10}")
+    for result in results:
+        print(f"{result['messages']:>10} {result['seconds']:>10.2f} {result['msgs_per_sec']:>10.1f} "
+              f"{result['peak_rss_mb']:>12.1f} {result['photos']:>8} {result['uploads']:>8} {result['flood_waits']:>10}")
+        print("           各階段耗時: " + ", ".join(f"{stage}={seconds:.2f}s" for stage, seconds in result["stages"].items()))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"target": args.target, "config": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"\n結果已寫入 {args.output}")
+
+    if args.min_msgs_per_sec is not None:
+        slow = [result for result in results if result["msgs_per_sec"] < args.min_msgs_per_sec]
+        if slow:
+            print(f"\n效能回歸：{', '.join(str(result['messages']) for result in slow)} 則訊息的情境低於 {args.min_msgs_per_sec} 訊息/秒。")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+# 命令列入口：python cli.py daily | backfill | export
+# 先解析參數，再載入 .env 並只匯入子命令需要的模組；查看說明或匯出時不會匯入 telethon、aiohttp 或連線 Telegram。
+import argparse
+import datetime
+import os
+import sys
+
+from settings import ConfigError, load_env
+
+
+def run_daily(args):
+    import everypy
+    everypy.run(since=args.since, until=args.until, incremental=args.incremental, reconcile=args.reconcile)
+
+
+def run_backfill(args):
+    import hispy
+    hispy.run(restart=args.restart)
+
+
+def run_export(args):
+    """不連線 Telegram，從貼文資料庫完整重新產生 posts.json（含壓縮檔與版本檔）、月份分片與搜尋索引。"""
+    from post_store import POST_STORE_FILE, PostStore
+    from posts_io import POSTS_JSON_COMPACT, POSTS_SHARD_DIR
+    from search_index import SEARCH_INDEX_DIR
+
+    def output_path(name):
+        return os.path.join(args.output_dir, name)
+
+    if not os.path.exists(output_path(POST_STORE_FILE)) and not os.path.exists(output_path("posts.json")):
+        raise ConfigError(f"{args.output_dir} 中沒有 {POST_STORE_FILE} 或 posts.json，無法匯出。")
+    with PostStore(output_path(POST_STORE_FILE), bootstrap_json=output_path("posts.json")) as store:
+        print(f"正在從 {output_path(POST_STORE_FILE)} 匯出 {store.count()} 筆貼文...")
+        store.export(output_path("posts.json"), shard_dir=output_path(POSTS_SHARD_DIR),
+                     index_dir=output_path(SEARCH_INDEX_DIR),
+                     compact=POSTS_JSON_COMPACT if args.compact is None else args.compact)
+    print("匯出完成。")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="濟公報 Telegram 頻道爬蟲")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    daily = subparsers.add_parser("daily", help="爬取頻道的新訊息並合併到 posts.json（每日排程使用）",
+                                  description="爬取 Telegram 頻道訊息並合併到 posts.json")
+    daily.add_argument("--incremental", action="store_true",
+                       help="只處理比 crawl_state.json 記錄的最後訊息 ID 更新的訊息")
+    daily.add_argument("--since", type=datetime.date.fromisoformat, metavar="YYYY-MM-DD",
+                       help="處理範圍的第一天（台灣時區）")
+    daily.add_argument("--until", type=datetime.date.fromisoformat, metavar="YYYY-MM-DD",
+                       help="處理範圍的最後一天（台灣時區，包含當天）")
+    daily.add_argument("--reconcile", choices=("recent", "all", "off"), default="recent",
+                       help="重新檢查已保存的訊息是否被編輯或刪除：recent 檢查最近的訊息並輪流檢查一部分舊訊息（預設），"
+                            "all 檢查所有訊息，off 不檢查")
+    daily.set_defaults(handler=run_daily)
+
+    backfill = subparsers.add_parser("backfill", help="回補頻道的完整歷史訊息",
+                                     description="回補 Telegram 頻道的完整歷史訊息到貼文資料庫與 posts.json")
+    backfill.add_argument("--restart", action="store_true",
+                          help="忽略 backfill_state.json 中的進度，重新回補所有區段")
+    backfill.set_defaults(handler=run_backfill)
+
+    export = subparsers.add_parser("export", help="從貼文資料庫重新產生 posts.json、月份分片與搜尋索引",
+                                   description="不連線 Telegram，從 posts.db 完整重新產生所有輸出檔")
+    export.add_argument("--output-dir", default=".",
+                        help="貼文資料庫與輸出檔所在的目錄，例如 channels/<頻道名稱>（預設為目前目錄）")
+    export.add_argument("--compact", action=argparse.BooleanOptionalAction, default=None,
+                        help="以每則貼文一行的緊湊格式輸出 posts.json 與月份分片（預設依 POSTS_JSON_COMPACT 環境變數）")
+    export.set_defaults(handler=run_export)
+    return parser
+
+
+def parse_args(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == "daily":
+        if args.incremental and (args.since or args.until):
+            parser.error("--incremental 不能與 --since/--until 同時使用")
+        if args.since and args.until and args.until < args.since:
+            parser.error("--until 不可早於 --since")
+    return args
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    # 在匯入 everypy/hispy 之前載入 .env，讓 .env 中的調校參數（例如 DOWNLOAD_WORKERS）生效
+    load_env()
+    try:
+        args.handler(args)
+    except ConfigError as e:
+        print(f"錯誤：{e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,312 @@
+# everypy.py 與 hispy.py 共用的爬取工具：自適應限速、依訊息 ID 範圍估算進度、增量爬取檢查點、歷史回補分段進度
+import asyncio
+import datetime
+import json
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+
+# --- 自適應限速器 ---
+class AdaptiveRateLimiter:
+    """
+    平常不額外延遲；只有在 Telegram 回傳 FloodWait 或請求明顯變慢時才退避，
+    之後隨著請求恢復正常逐步縮短延遲，直到回到零。
+    多個 worker（以及同一個客戶端上的多個頻道）可以共用同一個限速器，共同遵守同一份延遲：
+    FloodWait 的限制是針對整個帳號，任何一方收到 FloodWait 時，所有共用者都會暫停到指定時間為止。
+    max_concurrency 限制同時進行中的 Telegram 請求數量，為 None 時不限制。
+    """
+
+    def __init__(self, slow_threshold: float = 2.0, max_delay: float = 5.0,
+                 backoff_factor: float = 2.0, recovery_factor: float = 0.5,
+                 min_delay_step: float = 0.05, max_retries: int = 5, metrics=None,
+                 max_concurrency: int | None = None):
+        self.slow_threshold = slow_threshold # 單次請求超過此秒數即視為「變慢」
+        self.max_delay = max_delay
+        self.backoff_factor = backoff_factor
+        self.recovery_factor = recovery_factor
+        self.min_delay_step = min_delay_step
+        self.max_retries = max_retries
+        self.delay = 0.0 # 目前每次請求前的延遲秒數
+        self.resume_at = 0.0 # FloodWait 結束的時間 (time.monotonic)，在此之前所有請求都會等待
+        self._slots = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        self.flood_wait_count = 0
+        self.flood_wait_seconds_total = 0
+        self.metrics = metrics # 選用的 RunMetrics，記錄 Telegram 請求延遲與 FloodWait
+
+    def _back_off(self):
+        self.delay = min(self.max_delay, max(self.delay * self.backoff_factor, self.min_delay_step))
+
+    async def wait(self):
+        """在發出請求前呼叫；只有在 FloodWait 期間或之前退避過時才會真正等待。"""
+        pause = self.resume_at - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+        if self.delay > 0:
+            await asyncio.sleep(self.delay)
+
+    @asynccontextmanager
+    async def request_slot(self):
+        """占用一個同時請求的名額（沒有設定 max_concurrency 時不限制）。"""
+        if self._slots is None:
+            yield
+            return
+        async with self._slots:
+            yield
+
+    def record_latency(self, seconds: float):
+        """記錄一次請求的耗時：過慢就加大延遲，正常就逐步恢復。"""
+        if self.metrics:
+            self.metrics.observe("telegram_request", seconds)
+        if seconds >= self.slow_threshold:
+            self._back_off()
+        elif self.delay > 0:
+            self.delay *= self.recovery_factor
+            if self.delay < self.min_delay_step:
+                self.delay = 0.0
+
+    async def on_flood_wait(self, seconds: int):
+        """依照 Telegram 要求的秒數暫停，並加大後續請求的延遲。"""
+        self.flood_wait_count += 1
+        self.flood_wait_seconds_total += seconds
+        if self.metrics:
+            self.metrics.count("flood_waits")
+            self.metrics.count("flood_wait_seconds", seconds)
+        self._back_off()
+        print(f"\nTelegram 要求等待 {seconds} 秒 (FloodWait)，暫停後繼續...")
+        self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+        await self.wait()
+
+    async def call(self, func, *args, **kwargs):
+        """
+        在限速器控制下呼叫一個 Telethon 協程函式（例如 client.download_media）。
+        遇到 FloodWait 時等待後重試，最多重試 max_retries 次。
+        """
+        from telethon.errors import FloodWaitError
+
+        for attempt in range(self.max_retries + 1):
+            await self.wait()
+            try:
+                async with self.request_slot():
+                    started = time.monotonic()
+                    result = await func(*args, **kwargs)
+            except FloodWaitError as e:
+                if attempt >= self.max_retries:
+                    raise
+                await self.on_flood_wait(e.seconds)
+                if self.metrics:
+                    self.metrics.count("telegram_retries")
+                continue
+            self.record_latency(time.monotonic() - started)
+            return result
+
+
+async def iter_messages_adaptive(client, entity, limiter: AdaptiveRateLimiter, **kwargs):
+    """
+    包裝 client.iter_messages：每則訊息的取得都經過限速器，
+    遇到 FloodWait 時等待後從最後一則已取得的訊息 ID 繼續，不會重複或遺漏。
+    呼叫端應將 client.flood_sleep_threshold 設為 0，讓 FloodWait 交由限速器處理。
+    """
+    from telethon.errors import FloodWaitError
+
+    last_id = None
+    while True:
+        if last_id is not None:
+            # 從上次中斷處繼續：reverse=True 時取更新的訊息，否則取更舊的訊息
+            kwargs.pop("offset_date", None)
+            kwargs["offset_id"] = last_id
+
+        iterator = client.iter_messages(entity, **kwargs).__aiter__()
+        try:
+            while True:
+                await limiter.wait()
+                try:
+                    async with limiter.request_slot():
+                        started = time.monotonic()
+                        msg = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return
+                limiter.record_latency(time.monotonic() - started)
+                last_id = msg.id
+                yield msg
+        except FloodWaitError as e:
+            await limiter.on_flood_wait(e.seconds)
+            if limiter.metrics:
+                limiter.metrics.count("telegram_retries")
+
+
+# --- 依訊息 ID 範圍估算進度 ---
+class IdRangeProgress:
+    """
+    以訊息 ID 範圍估算進度，取代先完整遍歷一次頻道的計數步驟。
+    Telegram 頻道的訊息 ID 是遞增的，已刪除的訊息只會讓估計值偏高，不會讓進度倒退。
+    """
+
+    def __init__(self, first_id: int, last_id: int):
+        self.low_id = first_id
+        self.high_id = last_id
+
+    @property
+    def estimated_total(self) -> int:
+        return self.high_id - self.low_id + 1
+
+    def fraction(self, msg_id: int) -> float:
+        done = msg_id - self.low_id + 1
+        return max(0.0, min(1.0, done / self.estimated_total))
+
+    def format(self, processed_count: int, msg_id: int) -> str:
+        return f"{processed_count}/~{self.estimated_total} 筆訊息 ({self.fraction(msg_id) * 100:.2f}%)"
+
+
+# --- 增量爬取檢查點 ---
+class CrawlCheckpoint:
+    """
+    持久化的增量爬取進度。
+    last_message_id：已完整寫入輸出檔的最大訊息 ID（高水位線），增量模式下次只抓取比它新的訊息。
+    pending_posts：已處理完但尚未寫入輸出檔的貼文，定期存檔，崩潰後重新執行可從中途繼續。
+    下載/上傳是並行完成的，只有「連續處理完成」的訊息前綴才會被存入 pending_posts，
+    因此 pending_last_id 之前的訊息一定都已處理完畢。
+    """
+
+    def __init__(self, path: str, flush_interval: int = 20):
+        self.path = path
+        self.flush_interval = flush_interval # 每完成多少則訊息存檔一次
+        self.last_message_id = 0
+        self.run_key = None # 產生 pending_posts 的執行模式，例如 "incremental" 或 "2025-01-01~2025-01-07"
+        self.pending_last_id = 0
+        self.pending_posts = {} # 訊息 ID -> post 字典
+        self._in_flight = deque() # 已開始處理的訊息 ID（依遍歷順序）
+        self._finished = {} # 已完成但前面仍有未完成訊息的貼文
+        self._unsaved = 0
+
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    state = json.load(f)
+                self.last_message_id = int(state.get("last_message_id") or 0)
+                self.run_key = state.get("run_key")
+                self.pending_last_id = int(state.get("pending_last_id") or 0)
+                self.pending_posts = {post["id"]: post for post in state.get("pending_posts", [])}
+            except Exception as e:
+                print(f"警告：讀取檢查點 {path} 失敗: {e}。將視為沒有檢查點。")
+
+    def resume_after_id(self, run_key: str) -> int:
+        """若上次同一模式的執行中途中斷，回傳應從哪個訊息 ID 之後繼續；否則回傳 0。"""
+        if self.pending_posts and self.run_key == run_key:
+            return self.pending_last_id
+        return 0
+
+    def begin(self, run_key: str):
+        """開始新的執行。不同模式留下的 pending_posts 仍是有效的貼文，會保留到下次寫入。"""
+        if self.run_key != run_key:
+            self.pending_last_id = 0
+        self.run_key = run_key
+
+    def message_started(self, msg_id: int):
+        self._in_flight.append(msg_id)
+
+    def message_finished(self, msg_id: int, post_item: dict):
+        """標記一則訊息已處理完成（包含圖片上傳），並推進連續完成的前綴。"""
+        self._finished[msg_id] = post_item
+        while self._in_flight and self._in_flight[0] in self._finished:
+            done_id = self._in_flight.popleft()
+            self.pending_posts[done_id] = self._finished.pop(done_id)
+            self.pending_last_id = max(self.pending_last_id, done_id)
+            self._unsaved += 1
+        if self._unsaved >= self.flush_interval:
+            self.save()
+
+    def commit(self, last_message_id: int | None = None):
+        """輸出檔已成功寫入：清空 pending_posts，並在提供時推進高水位線。"""
+        if last_message_id is not None:
+            self.last_message_id = max(self.last_message_id, last_message_id)
+        self.pending_posts = {}
+        self.pending_last_id = 0
+        self.run_key = None
+        self.save()
+
+    def save(self):
+        # 不記錄儲存時間：狀態沒有改變時檔案內容也完全相同，每日排程不會因此產生新的提交
+        state = {
+            "last_message_id": self.last_message_id,
+            "run_key": self.run_key,
+            "pending_last_id": self.pending_last_id,
+            "pending_posts": [self.pending_posts[msg_id] for msg_id in sorted(self.pending_posts)],
+        }
+        # 先寫入暫存檔再替換，避免崩潰時留下寫了一半的檢查點
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.path)
+        self._unsaved = 0
+
+
+# --- 歷史回補的分段進度 ---
+class BackfillState:
+    """
+    將訊息 ID 空間 [1, latest_id] 切成固定大小的區段，記錄每個區段已處理到的訊息 ID。
+    各區段可並行抓取，中斷後重新執行只會從每個區段記錄的位置繼續，已完成的區段不會重抓。
+    """
+
+    def __init__(self, path: str, channel: str, partition_size: int):
+        self.path = path
+        self.channel = channel
+        self.partition_size = partition_size
+        self.latest_id = 0
+        self.partitions = [] # [{"low", "high", "next_id", "done"}]，依 ID 由小到大
+
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    state = json.load(f)
+                if state.get("channel") == channel and state.get("partition_size") == partition_size:
+                    self.latest_id = int(state.get("latest_id") or 0)
+                    self.partitions = state.get("partitions", [])
+                else:
+                    print(f"警告：{path} 記錄的頻道或區段大小與本次不同，將重新開始回補。")
+            except Exception as e:
+                print(f"警告：讀取回補進度 {path} 失敗: {e}。將重新開始回補。")
+
+    @property
+    def is_resumed(self) -> bool:
+        return bool(self.partitions)
+
+    def extend_to(self, latest_id: int):
+        """補上 latest_id 之前尚未切分的區段（第一次執行，或上次回補後頻道又有新訊息）。"""
+        low = self.partitions[-1]["high"] + 1 if self.partitions else 1
+        while low <= latest_id:
+            high = min(low + self.partition_size - 1, latest_id)
+            self.partitions.append({"low": low, "high": high, "next_id": low, "done": False})
+            low = high + 1
+        self.latest_id = max(self.latest_id, latest_id)
+
+    def pending_partitions(self) -> list:
+        return [partition for partition in self.partitions if not partition["done"]]
+
+    def advance(self, partition: dict, last_id: int):
+        """區段內 last_id（含）之前的訊息都已寫入資料庫。"""
+        partition["next_id"] = max(partition["next_id"], last_id + 1)
+
+    def finish(self, partition: dict):
+        partition["next_id"] = partition["high"] + 1
+        partition["done"] = True
+
+    def save(self):
+        state = {
+            "channel": self.channel,
+            "partition_size": self.partition_size,
+            "latest_id": self.latest_id,
+            "partitions": self.partitions,
+            "updated_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        }
+        # 先寫入暫存檔再替換，避免崩潰時留下寫了一半的進度
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False, indent=1)
+        os.replace(temp_path, self.path)
+
+    def clear(self):
+        """整個回補完成後刪除進度檔，下次執行會重新回補（重新驗證）完整歷史。"""
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -1,357 +1,888 @@
-import base64
-import json
+# 每日爬取：把頻道的新訊息與圖片合併到貼文資料庫並重新產生 posts.json
+# 匯入本模組沒有副作用（不讀取 .env、不建立 Telegram 客戶端、不匯入 telethon/aiohttp/requests），
+# 可以直接作為函式庫使用；命令列請執行 `python cli.py daily`（或直接執行本檔）。
+# 下方的調校參數在匯入時從環境變數讀取，cli.py 會先載入 .env 再匯入本模組。
 import os
 import io
 import datetime
 from datetime import timezone, timedelta
 import asyncio
+import concurrent.futures
 import re
+import sys
 import time
 
-# --- 導入 dotenv 庫來加載 .env 文件 ---
-# 確保在所有其他模組導入和配置之前調用 load_dotenv()
-from dotenv import load_dotenv
-load_dotenv() # 在此處加載 .env 文件中的環境變數
-
-from telethon import TelegramClient
-from telethon.tl.types import MessageMediaPhoto # 已在 Telethon 5.x 之後版本中包含，但明確導入可讀性更佳
-
-import requests
-
-# --- 必要的環境變數檢查 ---
-# 從環境變數讀取配置。這些變數應該在 .env 文件中設定。
-API_ID = os.getenv("TELEGRAM_API_ID")
-API_HASH = os.getenv("TELEGRAM_API_HASH")
-IMGBB_API_KEY = os.getenv("IMGBB_API_KEY")
-CHANNEL_USERNAME = os.getenv("CHANNEL_USERNAME")
+from crawl_utils import AdaptiveRateLimiter, CrawlCheckpoint, IdRangeProgress, iter_messages_adaptive
+from image_cache import ImageUploadCache
+from image_storage import IMAGE_STORAGE, IMGBB_UPLOAD_URL, ImageStorage, create_image_storage
+from image_variants import IMAGE_PROCESS_WORKERS, build_image_variants
+from metrics import RunMetrics, format_eta, load_previous_rate
+from post_store import POST_STORE_FILE, PostStore, post_meta_path
+from posts_io import POSTS_SHARD_DIR
+from search_index import SEARCH_INDEX_DIR
+from settings import ConfigError, create_telegram_client, load_env, require_env
 
 OUTPUT_JSON_FILE = "posts.json" # 輸出到這個 JSON 檔案
+CHECKPOINT_FILE = "crawl_state.json" # 增量爬取的高水位線與中途進度
+METRICS_FILE = os.getenv("METRICS_FILE", "run_metrics.json") # 每次執行的各階段耗時、計數器與延遲直方圖
+NOTIFICATION_URL = "https://jigong-news-backend.onrender.com/api/send-daily-notification"
+NOTIFICATION_DELAY_SECONDS = 10 # 寫入後等待幾秒再發送推播通知，讓 GitHub Pages 有時間部署新的 posts.json
+
+# --- 並行下載/上傳管線設定 ---
+# 訊息遍歷會把圖片任務放入有界佇列，由多個下載 worker 與上傳 worker 同時處理。
+# 佇列大小限制了同時存在於記憶體中的圖片數量，避免回補大量訊息時記憶體暴增。
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "3"))
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "3"))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "8"))
+# 下載後在 process pool 中產生縮圖 (thumb) 與中尺寸 (medium) 版本，一併上傳；設為 0 則只上傳原圖
+ENABLE_IMAGE_VARIANTS = os.getenv("ENABLE_IMAGE_VARIANTS", "1") != "0"
+# 除了 "image" 之外，和圖片相關、需要隨圖片連結一起沿用的欄位
+IMAGE_RECORD_FIELDS = ("width", "height", "variants")
+
+# --- 多頻道設定 ---
+# 所有頻道共用同一個已登入的 Telethon 連線並行爬取，各自有獨立的輸出檔與檢查點。
+CHANNELS_DIR = "channels" # 第二個之後的頻道預設輸出到 channels/<頻道名稱>/
+# 同時進行中的 Telegram 請求上限（訊息遍歷與圖片下載），由所有頻道共用
+TELEGRAM_MAX_CONCURRENCY = int(os.getenv("TELEGRAM_MAX_CONCURRENCY", "4"))
+
+# --- 編輯與刪除的偵測 ---
+# 以 get_messages(ids=...) 批次重新取得已保存的訊息（每次請求最多 100 則），找出被編輯或刪除的訊息。
+# recent 模式每次檢查最近 RECONCILE_DAYS 天的訊息，並依日期輪流檢查 RECONCILE_OLDER_BATCHES 批較舊的訊息，
+# 每天只多出幾次請求，數天內就會輪完整個頻道；all 模式一次檢查所有訊息；off 不檢查。
+RECONCILE_MODES = ("recent", "all", "off")
+RECONCILE_BATCH_SIZE = 100 # Telegram 每次以 ID 取得訊息的上限
+RECONCILE_DAYS = int(os.getenv("RECONCILE_DAYS", "30"))
+RECONCILE_OLDER_BATCHES = int(os.getenv("RECONCILE_OLDER_BATCHES", "5"))
+
+class ChannelTarget:
+    """要爬取的頻道與它的輸出目錄：posts.json、貼文資料庫、檢查點、月份分片與搜尋索引都放在此目錄下。"""
+
+    def __init__(self, channel: str, output_dir: str = "."):
+        self.channel = channel
+        self.output_dir = os.path.normpath(output_dir)
+
+    def path(self, file_name: str) -> str:
+        return os.path.normpath(os.path.join(self.output_dir, file_name))
+
+    @property
+    def is_site_root(self) -> bool:
+        """輸出到目前目錄的頻道就是網站使用的 posts.json。"""
+        return self.output_dir == "."
+
+def channel_dir_name(channel: str) -> str:
+    """由頻道用戶名或連結（例如 @name、https://t.me/name）取得可作為目錄名稱的頻道名稱。"""
+    name = channel.rstrip("/").rsplit("/", 1)[-1].lstrip("@")
+    return re.sub(r'[^\w.-]', '_', name) or "channel"
+
+def parse_channel_targets(value: str) -> list:
+    """
+    解析 CHANNEL_USERNAME：以逗號分隔多個頻道，並可用「頻道=輸出目錄」指定輸出位置，
+    例如 "jigongnews,otherchannel=mirrors/other"。
+    第一個頻道預設輸出到目前目錄（網站使用的 posts.json），其他頻道預設輸出到 channels/<頻道名稱>/。
+    """
+    targets = []
+    for entry in value.split(","):
+        channel, _, output_dir = (part.strip() for part in entry.partition("="))
+        if not channel:
+            continue
+        if not output_dir:
+            output_dir = "." if not targets else os.path.join(CHANNELS_DIR, channel_dir_name(channel))
+        targets.append(ChannelTarget(channel, output_dir))
+    if not targets:
+        raise ValueError("沒有任何頻道")
+    output_dirs = [target.output_dir for target in targets]
+    duplicates = sorted({output_dir for output_dir in output_dirs if output_dirs.count(output_dir) > 1})
+    if duplicates:
+        raise ValueError(f"多個頻道使用相同的輸出目錄: {', '.join(duplicates)}")
+    return targets
+
+# --- Telethon 客戶端 ---
+# 第一次呼叫 get_client() 時才檢查憑證、還原 anon.session 並建立客戶端（不會在匯入時建立）。
+# 測試或效能測試可以直接把 client 換成模擬的客戶端。
+client = None
+
+def get_client():
+    global client
+    if client is None:
+        load_env()
+        client = create_telegram_client()
+    return client
+
+def load_channel_targets() -> list:
+    """讀取並檢查每日爬取需要的環境變數，回傳 CHANNEL_USERNAME 列出的頻道。設定有誤時拋出 ConfigError。"""
+    load_env()
+    channel_usernames = require_env("CHANNEL_USERNAME")["CHANNEL_USERNAME"]
+    if IMAGE_STORAGE == "imgbb":
+        require_env("IMGBB_API_KEY")
+    try:
+        return parse_channel_targets(channel_usernames)
+    except ValueError as e:
+        raise ConfigError(f"CHANNEL_USERNAME 的設定無效: {e}") from None
 
-# 檢查所有必要的環境變數是否都已設定
-if not all([API_ID, API_HASH, IMGBB_API_KEY, CHANNEL_USERNAME]):
-    print("錯誤：請確保已在 .env 文件或系統環境變數中設定以下所有必要變數：")
-    print("  - TELEGRAM_API_ID (Telegram API ID)")
-    print("  - TELEGRAM_API_HASH (Telegram API Hash)")
-    print("  - IMGBB_API_KEY (ImgBB API Key)")
-    print("  - CHANNEL_USERNAME (Telegram 頻道用戶名或連結，例如 @yourchannel)")
-    print("\n請檢查您的 '.env' 文件是否與腳本在同一個目錄中，且變數名稱和值是否正確。")
-    print("例如：TELEGRAM_API_ID=12345678")
-    exit(1)
-
-# 將 TELEGRAM_API_ID 轉換為整數，並處理可能發生的錯誤
-try:
-    API_ID = int(API_ID)
-except ValueError:
-    print("錯誤：TELEGRAM_API_ID 必須是有效的數字。請檢查 .env 文件或環境變數中的值。")
-    exit(1)
-
-# --- 還原 anon.session 檔案（若使用 TELETHON_SESSION 環境變數）---
-# 此部分允許將 Telethon session 字串透過環境變數傳遞，適合於容器化部署。
-if os.getenv("TELETHON_SESSION"):
-    print("檢測到 TELETHON_SESSION 環境變數，正在解碼並還原 anon.session 檔案...")
+def build_image_storage() -> ImageStorage:
+    """依 IMAGE_STORAGE 建立圖片儲存後端（imgbb 或 local）。"""
     try:
-        with open("anon.session", "wb") as f:
-            f.write(base64.b64decode(os.getenv("TELETHON_SESSION")))
-        print("anon.session 檔案還原成功。")
-    except Exception as e:
-        print(f"錯誤：還原 anon.session 檔案失敗: {e}")
-        print("請確保 TELETHON_SESSION 環境變數包含有效的 base64 編碼字串。")
-        exit(1)
-else:
-    print("未檢測到 TELETHON_SESSION 環境變數，將嘗試使用現有的 anon.session 檔案。")
-    print("如果 anon.session 不存在或無效，Telethon 可能會要求您登錄。")
-
-# --- Telethon 客戶端初始化 ---
-# 'anon' 會是 session 檔案名 (anon.session)。
-# 確保這個 anon.session 檔案存在且有效，否則 Telethon 會嘗試重新登入（需要電話驗證）。
-# 傳遞的 API_ID 和 API_HASH 必須與生成 anon.session 時所用的憑證匹配。
-client = TelegramClient('anon', API_ID, API_HASH)
+        if IMAGE_STORAGE == "imgbb":
+            return create_image_storage("imgbb", metrics=metrics, api_key=os.getenv("IMGBB_API_KEY"),
+                                        upload_url=IMGBB_UPLOAD_URL, pool_size=UPLOAD_WORKERS)
+        return create_image_storage(IMAGE_STORAGE, metrics=metrics)
+    except ValueError as e:
+        raise ConfigError(str(e)) from None
 
 # --- 時區定義 ---
 # 定義台灣時區，用於確保日期時間處理的準確性
 TW_TZ = timezone(timedelta(hours=8))
 
-# --- 定義今天要處理的日期範圍 ---
-# 腳本只會處理當天（從當天 00:00:00 到隔天 00:00:00）的訊息。
-CURRENT_RUN_DATE = datetime.datetime.now(TW_TZ).date() # 獲取當前在台灣時區的日期
-MIN_DATE_TO_PROCESS = datetime.datetime(CURRENT_RUN_DATE.year, CURRENT_RUN_DATE.month, CURRENT_RUN_DATE.day, 0, 0, 0, tzinfo=TW_TZ)
-MAX_DATE_TO_PROCESS = MIN_DATE_TO_PROCESS + timedelta(days=1) # 處理到今天的結束 (即明天00:00:00)
+# 本次執行的指標；main() 開始時重設，結束時寫入 METRICS_FILE
+metrics = RunMetrics()
 
-print(f"設定處理日期範圍：從 {MIN_DATE_TO_PROCESS.strftime('%Y-%m-%d %H:%M:%S %Z%z')} 到 {MAX_DATE_TO_PROCESS.strftime('%Y-%m-%d %H:%M:%S %Z%z')}")
+# --- 定義要處理的日期範圍 ---
+def build_date_window(since: datetime.date | None = None, until: datetime.date | None = None) -> tuple[datetime.datetime, datetime.datetime]:
+    """
+    回傳 (MIN_DATE_TO_PROCESS, MAX_DATE_TO_PROCESS)，範圍為 [since 00:00:00, until 隔天 00:00:00)。
+    未指定 until 時處理到今天為止；兩者都未指定時只處理當天（從當天 00:00:00 到隔天 00:00:00）的訊息。
+    """
+    current_run_date = datetime.datetime.now(TW_TZ).date() # 獲取當前在台灣時區的日期
+    since = since or until or current_run_date # 只指定 until 時只處理那一天
+    until = until or current_run_date
+    if until < since:
+        raise ValueError(f"--until ({until}) 不可早於 --since ({since})")
+    min_date_to_process = datetime.datetime(since.year, since.month, since.day, 0, 0, 0, tzinfo=TW_TZ)
+    max_date_to_process = datetime.datetime(until.year, until.month, until.day, 0, 0, 0, tzinfo=TW_TZ) + timedelta(days=1)
+    return min_date_to_process, max_date_to_process
+
+# --- 圖片命名函式 ---
+def build_photo_file_name(msg, msg_date_tw_str: str) -> str:
+    """圖片命名邏輯：日期_ID_文本片段.jpg"""
+    text_snippet = (msg.text or "").strip()
+    if text_snippet:
+        # 移除文件名中不允許的字元（包含換行等控制字元，否則上傳時的 multipart 標頭會被拒絕）
+        text_snippet = re.sub(r'[\\/:*?"<>|\x00-\x1f]', '', text_snippet)
+        text_snippet = text_snippet.replace(' ', '_')
+        text_snippet = text_snippet[:30] # 限制長度
+        if text_snippet:
+            text_snippet = f"_{text_snippet}" # 添加下劃線前綴
+    else:
+        text_snippet = ""
+
+    file_extension = '.jpg' # 大多數 Telegram 圖片會是 JPEG
+    return f"{msg_date_tw_str}_{msg.id}{text_snippet}{file_extension}"
 
-# --- 上傳到 ImgBB 函式 ---
-async def upload_to_imgbb(file_bytes_io: io.BytesIO, file_name: str, mime_type: str) -> str | None:
+# --- 編輯偵測 ---
+def format_edit_date(msg) -> str | None:
+    return msg.edit_date.isoformat() if msg.edit_date else None
+
+def message_changed(msg, state: dict) -> bool:
+    """
+    比對重新取得的訊息與資料庫中的貼文 (state 來自 PostStore.get_message_states)。
+    編輯時間與上次記錄的相同時不必比對內容；圖片只有在被替換或原本沒有連結時才算改變
+    （沒有記錄圖片 ID 的舊貼文無法判斷是否被替換，視為相同）。
+    """
+    edit_date = format_edit_date(msg)
+    if edit_date is not None and edit_date == state["edit_date"]:
+        return False
+    post = state["post"]
+    if (msg.text or "") != (post.get("text") or ""):
+        return True
+    if msg.photo and not post.get("image"):
+        return True
+    return bool(msg.photo) and state["photo_id"] is not None and msg.photo.id != state["photo_id"]
+
+# --- 上傳各尺寸版本 ---
+async def upload_image_variants(storage: ImageStorage, variants: dict, file_name: str) -> dict:
     """
-    將圖片從記憶體上傳到 ImgBB 並返回其 URL。
-    如果上傳失敗，則打印錯誤訊息並返回 None。
+    同時上傳縮圖與中尺寸版本，回傳 {名稱: {"url", "width", "height"}}。
+    上傳失敗的版本會被略過，前端會改用原圖。
     """
-    file_bytes_io.seek(0) # 確保文件指針在文件開頭
+    file_stem = os.path.splitext(file_name)[0]
+    names = list(variants)
+    urls = await asyncio.gather(*(
+        storage.store(variants[name]["data"], f"{file_stem}_{name}{variants[name]['ext']}", variants[name]["mime_type"])
+        for name in names
+    ))
+    return {
+        name: {"url": url, "width": variants[name]["width"], "height": variants[name]["height"]}
+        for name, url in zip(names, urls) if url
+    }
+
+# --- 管線 worker ---
+def finish_photo_job(job: dict, image_record: dict | None, pending_photo_jobs: dict):
+    """
+    一張圖片處理完成（image_record 為 None 代表下載或上傳失敗）：把結果寫回這個任務，
+    以及處理期間排入、等待同一張圖片的其他任務（例如其他頻道轉發的同一張圖片），並標記這些訊息已處理完成。
+    """
+    pending_photo_jobs.pop(job["photo_key"], None)
+    for photo_job in [job, *job["waiting_jobs"]]:
+        msg_id = photo_job["msg"].id
+        channel_crawl = photo_job["channel_crawl"]
+        if image_record:
+            photo_job["post_item"].update(image_record)
+            channel_crawl.uploaded_urls_by_id[msg_id] = image_record["image"]
+        try:
+            channel_crawl.checkpoint.message_finished(msg_id, photo_job["post_item"])
+        except Exception as e:
+            # 檢查點只用於中斷後恢復，存檔失敗不影響本次寫入；不能讓呼叫它的 worker 因此中止
+            print(f"警告：[{channel_crawl.channel}] 儲存檢查點失敗: {e}")
 
-    try:
-        print(f"正在上傳圖片 '{file_name}' 到 ImgBB...")
-        response = requests.post(
-            "https://api.imgbb.com/1/upload",
-            params={"key": IMGBB_API_KEY},
-            files={"image": (file_name, file_bytes_io, mime_type)} # file_name 是一個提示名稱，不會影響實際儲存
-        )
-        response.raise_for_status() # 對於 4xx 或 5xx 的回應碼拋出 HTTPError
-        data = response.json()
-
-        if data and data.get("success"):
-            img_url = data["data"]["url"]
-            print(f"圖片 '{file_name}' 上傳成功，URL: {img_url}")
-            return img_url
-        else:
-            error_message = data.get('error', {}).get('message', '未知錯誤')
-            print(f"\nImgBB 上傳失敗 ({file_name}): {error_message}") # 錯誤時打印新行
-            return None
-    except requests.exceptions.RequestException as e:
-        print(f"\nImgBB 上傳請求失敗 ({file_name}): {e}") # 網路或 HTTP 錯誤
-        return None
-    except Exception as e:
-        print(f"\nImgBB 上傳過程中發生意外錯誤 ({file_name}): {e}") # 其他通用錯誤
-        return None
+async def download_worker(limiter: AdaptiveRateLimiter, image_cache: ImageUploadCache, pending_photo_jobs: dict,
+                          download_queue: asyncio.Queue, optimize_queue: asyncio.Queue):
+    """
+    從下載佇列取出圖片任務，下載到記憶體後交給最佳化佇列。
+    下載經過共用的限速器，遇到 FloodWait 時會等待後重試。
+    下載後先以內容雜湊查詢圖片上傳快取，內容相同的圖片直接沿用舊連結，不再上傳。
+    收到 None（結束信號）時退出。
+    """
+    client = get_client()
+    while True:
+        job = await download_queue.get()
+        if job is None:
+            return
 
-# --- 主要處理流程函式 ---
-async def main():
-    print(f"\n--- 腳本開始運行於：{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ---")
-    start_time = time.time() # 記錄腳本開始運行時間
+        msg = job["msg"]
+        photo_bytes_io = io.BytesIO() # 創建一個記憶體中的位元組流來儲存圖片
 
-    # 1. 讀取現有 posts.json 中的所有數據，並以 (date, text_key) 為鍵建立查找字典
-    existing_data_from_file = []
-    # 鍵為 (date_str, text_snippet)，值為完整的 post 字典
-    # 用於檢查是否已存在，以及是否需要更新圖片連結。
-    existing_posts_by_key = {}
+        async def download_photo():
+            # Telethon 邊下載邊寫入；FloodWait 可能發生在寫入部分內容之後，每次重試前先清空緩衝區
+            photo_bytes_io.seek(0)
+            photo_bytes_io.truncate()
+            return await client.download_media(msg.photo, file=photo_bytes_io)
 
-    if os.path.exists(OUTPUT_JSON_FILE):
-        print(f"正在讀取現有的 {OUTPUT_JSON_FILE} 以合併新數據...")
         try:
-            with open(OUTPUT_JSON_FILE, "r", encoding="utf-8") as f:
-                existing_data_from_file = json.load(f)
-
-            for post in existing_data_from_file:
-                post_date = post.get("date")
-                # 取前 50 字作為文本鍵，用於匹配重複貼文
-                post_text_key = (post.get("text") or "").strip()[:50]
-                if post_date:
-                    existing_posts_by_key[(post_date, post_text_key)] = post
-            print(f"已讀取 {len(existing_data_from_file)} 筆舊貼文，其中 {len(existing_posts_by_key)} 筆可通過日期+文本識別。")
-        except json.JSONDecodeError:
-            print(f"警告：{OUTPUT_JSON_FILE} 不是有效的 JSON 格式。將忽略其內容並創建新檔案。")
-            existing_data_from_file = []
-            existing_posts_by_key = {}
+            print(f"正在下載訊息 (ID:{msg.id}) 的圖片...")
+            with metrics.span("telegram_download"):
+                await limiter.call(download_photo)
+            print(f"圖片下載完成，大小：{photo_bytes_io.tell()} bytes。")
+            metrics.count("images_downloaded")
+            metrics.count("bytes_downloaded", photo_bytes_io.tell())
         except Exception as e:
-            print(f"讀取或處理 {OUTPUT_JSON_FILE} 失敗: {e}。將不保留舊數據。")
-            existing_data_from_file = []
-            existing_posts_by_key = {}
-    else:
-        print(f"找不到 {OUTPUT_JSON_FILE}，將創建新檔案。")
+            print(f"處理訊息 (ID:{msg.id}) 的圖片時發生錯誤: {e}")
+            metrics.count("download_failures")
+            photo_bytes_io.close()
+            finish_photo_job(job, None, pending_photo_jobs) # 下載失敗的貼文不含圖片連結
+            continue
+
+        content_key = ImageUploadCache.content_key(photo_bytes_io.getbuffer())
+        cached = image_cache.get(content_key)
+        if cached:
+            print(f"訊息 (ID:{msg.id}) 的圖片內容與已上傳的圖片相同，沿用快取連結。")
+            photo_bytes_io.close()
+            image_cache.put([job["photo_key"]], cached) # 記錄這個圖片 ID，下次不必再下載
+            finish_photo_job(job, cached, pending_photo_jobs)
+            continue
+
+        job["photo_bytes_io"] = photo_bytes_io
+        job["content_key"] = content_key
+        await optimize_queue.put(job) # 佇列已滿時會在此等待，形成背壓
+
+async def optimize_worker(pool: concurrent.futures.Executor | None, optimize_queue: asyncio.Queue, upload_queue: asyncio.Queue):
+    """
+    從最佳化佇列取出已下載的圖片，在 process pool 中產生縮圖與中尺寸版本後交給上傳佇列。
+    圖片編碼是 CPU 密集工作，放在其他行程中執行，才不會卡住同時進行的下載與上傳。
+    pool 為 None（停用圖片版本）或最佳化失敗時，只上傳原圖。
+    收到 None（結束信號）時退出。
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        job = await optimize_queue.get()
+        if job is None:
+            return
+
+        job["optimized"] = None
+        if pool is not None:
+            try:
+                with metrics.span("image_optimize"):
+                    job["optimized"] = await loop.run_in_executor(pool, build_image_variants, job["photo_bytes_io"].getvalue())
+            except Exception as e:
+                print(f"警告：訊息 (ID:{job['msg'].id}) 的圖片最佳化失敗，將只上傳原圖: {e}")
+        await upload_queue.put(job)
 
-    # 2. 連接 Telegram 並獲取頻道實體
-    entity = None
-    try:
-        print(f"正在嘗試連接 Telegram 並獲取頻道 '{CHANNEL_USERNAME}' 的實體...")
+async def upload_worker(storage: ImageStorage, image_cache: ImageUploadCache, pending_photo_jobs: dict,
+                        upload_queue: asyncio.Queue):
+    """
+    從上傳佇列取出已下載的圖片並交給圖片儲存後端（原圖與各尺寸版本），成功後直接寫回對應的 post_item
+    （以及等待同一張圖片的其他任務），並以圖片 ID 與內容雜湊記錄到圖片上傳快取。
+    收到 None（結束信號）時退出。
+    """
+    while True:
+        job = await upload_queue.get()
+        if job is None:
+            return
 
-        # 檢查 Telethon 客戶端是否成功登入 (使用了 Session)。
-        # 嘗試獲取自己的信息是確認 Telethon Session 是否成功載入並授權的最佳方式。
-        me = await client.get_me()
-        print(f"Telethon 客戶端已成功登入為：{me.first_name} {me.last_name if me.last_name else ''} (ID: {me.id})")
+        msg = job["msg"]
+        image_record = None
+        try:
+            uploaded_url = await storage.store(job["photo_bytes_io"].getvalue(), job["file_name"], 'image/jpeg')
+            if uploaded_url:
+                image_record = {"image": uploaded_url}
+                optimized = job.get("optimized")
+                if optimized:
+                    image_record["width"] = optimized["width"]
+                    image_record["height"] = optimized["height"]
+                    image_record["variants"] = await upload_image_variants(storage, optimized["variants"], job["file_name"])
+                image_cache.put([job["photo_key"], job["content_key"]], image_record)
+            else:
+                print(f"警告：圖片上傳失敗，訊息 (ID:{msg.id}) 將不包含圖片連結。")
+        except Exception as e:
+            # 儲存後端只處理預期的錯誤（例如 LocalStorage 只處理 OSError），其他錯誤也只讓這張圖片失敗，worker 繼續處理下一個任務
+            print(f"警告：上傳訊息 (ID:{msg.id}) 的圖片時發生錯誤，將不包含圖片連結: {e}")
+            metrics.count("upload_failures")
+            image_record = None
+        finally:
+            job["photo_bytes_io"].close() # 確保關閉記憶體流以釋放資源
+        finish_photo_job(job, image_record, pending_photo_jobs)
 
-        entity = await client.get_entity(CHANNEL_USERNAME)
-        print(f"成功獲取頻道 '{CHANNEL_USERNAME}' 實體。")
-    except Exception as e:
-        print(f"錯誤：無法連接 Telegram 或獲取頻道 '{CHANNEL_USERNAME}' 的實體: {e}")
-        print("請確保 CHANNEL_USERNAME 正確，您的 Telegram 帳號可以訪問此頻道，且 anon.session 有效。")
-        print("如果您遇到 PhoneNumberBannedError，可能需要檢查您的帳號狀態或更換帳號。")
-        print(f"--- 腳本結束於：{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ---")
-        return # 終止腳本執行
 
-    # 3. 獲取今天訊息的總數（用於精確進度條）
-    print(f"正在取得今天 ({MIN_DATE_TO_PROCESS.strftime('%Y-%m-%d')}) 的訊息總數 (這可能需要一些時間)...")
-    total_messages_today = 0
+async def supervise_workers(aw, workers: list):
+    """
+    執行 aw 並同時監看管線 worker，回傳 aw 的結果。
+    worker 意外中止後不會再從佇列取出任務，把任務或結束信號放入有界佇列的一方會永遠等待；
+    這時取消 aw 與所有 worker，並拋出該 worker 的錯誤。
+    """
+    main_task = asyncio.ensure_future(aw)
+    pending = {main_task, *workers}
     try:
-        # 第一次遍歷：僅用於計數今天範圍內的訊息。
-        # 從結束日期 (MAX_DATE_TO_PROCESS) 開始往回抓取，直到遇到處理日期範圍外的訊息。
-        async for msg in client.iter_messages(entity, offset_date=MAX_DATE_TO_PROCESS):
-            # 如果訊息日期比我們設定的開始日期還早，就停止計數，因為已超出範圍。
-            if msg.date.astimezone(TW_TZ) < MIN_DATE_TO_PROCESS:
-                break
-            total_messages_today += 1
-        print(f"今天頻道 '{CHANNEL_USERNAME}' 總共有 {total_messages_today} 筆訊息，開始處理...")
-    except Exception as e:
-        print(f"錯誤：在計數訊息時發生錯誤: {e}")
-        print("這可能是由於網路問題或 Telegram API 暫時性故障。將嘗試繼續處理但無法顯示總進度。")
-        total_messages_today = 0 # 將總數設為 0，以便進度條顯示不依賴總數
-
-    # 計算預估完成時間（基於每個訊息的處理時間）
-    estimated_time_per_message = 0.15 # 每次循環的 asyncio.sleep() 時間加上估計的下載/上傳預留時間
-    if total_messages_today > 0:
-        estimated_total_seconds = total_messages_today * estimated_time_per_message
-        estimated_end_time = datetime.datetime.now(TW_TZ) + datetime.timedelta(seconds=estimated_total_seconds)
-        print(f"預計完成時間：{estimated_end_time.strftime('%Y-%m-%d %H:%M:%S %Z%z')}")
-    else:
-        print("無法預估完成時間，因為今天沒有新訊息或無法獲取總數。")
+        while not main_task.done():
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            failed = [task for task in done if task is not main_task and (task.cancelled() or task.exception())]
+            if failed:
+                print("\n錯誤：圖片管線的 worker 意外中止，停止本次執行。")
+                errors = [task.exception() for task in failed if not task.cancelled()]
+                raise errors[0] if errors else asyncio.CancelledError()
+        return main_task.result()
+    except BaseException:
+        main_task.cancel()
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(main_task, *workers, return_exceptions=True)
+        raise
+
+
+async def drain_pipeline(stages: list):
+    """stages 為 [(佇列, worker 任務)]，依上游到下游的順序送出結束信號，並等待 worker 處理完佇列中的任務。"""
+    for queue, tasks in stages:
+        for _ in tasks:
+            await queue.put(None)
+        await asyncio.gather(*tasks)
+
+# --- 單一頻道的爬取 ---
+class ChannelCrawl:
+    """
+    一個頻道在本次執行中的狀態：貼文資料庫、增量檢查點，以及本次處理過的貼文。
+    各頻道的 crawl() 同時執行，共用同一個 Telethon 連線、限速器與圖片管線；
+    管線全部處理完畢後，再由 write() 寫入該頻道自己的輸出檔並推進它的檢查點。
+    """
 
-    processed_count = 0
-    # 儲存本次運行處理過的訊息，以 (date, text_key) 為鍵。
-    # 這用於在最後與舊數據合併，確保新抓取的數據覆蓋舊數據。
-    messages_processed_in_this_run_by_key = {}
+    def __init__(self, target: ChannelTarget, run_key: str, incremental: bool, reconcile: str = "recent"):
+        self.target = target
+        self.channel = target.channel
+        self.incremental = incremental
+        self.reconcile_mode = reconcile # 編輯與刪除的偵測範圍，見 RECONCILE_MODES
+        self.output_json_file = target.path(OUTPUT_JSON_FILE)
+        self.completed = False # 訊息遍歷是否完整結束；中途失敗的頻道不寫入輸出檔，下次從檢查點繼續
+        os.makedirs(target.output_dir, exist_ok=True)
+
+        # 1. 開啟貼文資料庫（不存在時會從現有的 posts.json 匯入一次）
+        # 以訊息 ID 為鍵（沒有 ID 的舊貼文以 (date, text_key)），只需查詢本次處理的訊息，不必把整個 posts.json 載入記憶體。
+        store_file = target.path(POST_STORE_FILE)
+        self.store = PostStore(store_file, bootstrap_json=self.output_json_file)
+        print(f"[{self.channel}] 貼文資料庫 {store_file} 目前共有 {self.store.count()} 筆貼文。")
+
+        # 1.5 讀取檢查點：高水位線，以及上次中斷時已處理完但尚未寫入的貼文
+        self.checkpoint = CrawlCheckpoint(target.path(CHECKPOINT_FILE))
+        resume_after_id = self.checkpoint.resume_after_id(run_key)
+        self.checkpoint.begin(run_key)
+        self.resumed_posts = list(self.checkpoint.pending_posts.values())
+        if self.resumed_posts:
+            print(f"[{self.channel}] 從檢查點恢復 {len(self.resumed_posts)} 筆上次中斷前已處理完成的貼文。")
+
+        self.min_id = resume_after_id
+        if incremental:
+            # 沒有檢查點時，以資料庫中最大的訊息 ID 作為高水位線
+            high_water_mark = self.checkpoint.last_message_id or self.store.max_message_id()
+            self.min_id = max(self.min_id, high_water_mark)
+            print(f"[{self.channel}] 增量模式：只處理訊息 ID 大於 {self.min_id} 的訊息。")
+        elif resume_after_id:
+            print(f"[{self.channel}] 上次相同範圍的執行中途中斷，將從訊息 ID {resume_after_id} 之後繼續。")
+
+        self.processed_count = 0
+        # 本次運行處理過的貼文，以訊息 ID 為鍵。
+        # 下載/上傳 worker 會以不同順序完成，最後依訊息 ID 排序後再合併，確保結果是確定的。
+        self.processed_posts_by_id = {post["id"]: post for post in self.resumed_posts}
+        # 訊息 ID -> Telegram 圖片 ID，寫入資料庫後可用於以圖片 ID 查詢已上傳的連結
+        self.photo_ids_by_msg_id = {}
+        # 訊息 ID -> 最後編輯時間，寫入資料庫後用於判斷下次重新取得的訊息是否又被編輯
+        self.edit_dates_by_msg_id = {}
+        # 本次新取得的圖片連結（上傳成功或命中圖片上傳快取），以訊息 ID 為鍵。
+        # 只要有任何一筆，就代表有新的圖片貼文。
+        self.uploaded_urls_by_id = {}
+        # 重新檢查已保存的訊息後，發現被編輯（已重新處理）與已被刪除的訊息 ID
+        self.edited_ids = set()
+        self.deleted_ids = set()
+
+    async def crawl(self, limiter: AdaptiveRateLimiter, image_cache: ImageUploadCache, pending_photo_jobs: dict,
+                    download_queue: asyncio.Queue, min_date_to_process: datetime.datetime | None,
+                    max_date_to_process: datetime.datetime | None, previous_message_rate: float | None):
+        """遍歷範圍內的訊息，需要上傳的圖片放入共用的下載佇列。"""
+        client = get_client()
+        # 2. 獲取頻道實體
+        try:
+            print(f"正在獲取頻道 '{self.channel}' 的實體...")
+            with metrics.span("telegram_connect"):
+                entity = await limiter.call(client.get_entity, self.channel)
+            print(f"成功獲取頻道 '{self.channel}' 實體。")
+        except Exception as e:
+            print(f"錯誤：無法獲取頻道 '{self.channel}' 的實體: {e}")
+            print("請確保 CHANNEL_USERNAME 正確，且您的 Telegram 帳號可以訪問此頻道。")
+            raise # 交給 main()：其他頻道照常寫入，最後以此錯誤結束，設定錯誤的頻道不會被忽略
 
-    # 新增一個標誌，用於判斷今天是否有任何圖片成功上傳到 ImgBB
-    any_new_image_uploaded_today = False
+        # 3. 以訊息 ID 範圍估算要處理的訊息數（取代先完整遍歷一次的計數步驟）
+        # 只需兩次 limit=1 的查詢：範圍開始前最後一則訊息，以及範圍結束前最後一則訊息。
+        progress = None
+        try:
+            if self.min_id:
+                first_id_in_range = self.min_id + 1
+            elif min_date_to_process is None:
+                first_id_in_range = 1 # 增量模式且沒有任何高水位線：處理整個頻道
+            else:
+                last_before_range = await limiter.call(client.get_messages, entity, limit=1, offset_date=min_date_to_process)
+                first_id_in_range = (last_before_range[0].id + 1) if last_before_range else 1
+            if max_date_to_process:
+                last_in_range = await limiter.call(client.get_messages, entity, limit=1, offset_date=max_date_to_process)
+            else:
+                last_in_range = await limiter.call(client.get_messages, entity, limit=1)
+            if last_in_range and last_in_range[0].id >= first_id_in_range:
+                progress = IdRangeProgress(first_id_in_range, last_in_range[0].id)
+                print(f"頻道 '{self.channel}' 在處理範圍內約有 {progress.estimated_total} 筆訊息 (ID {first_id_in_range}~{last_in_range[0].id})，開始處理...")
+            else:
+                print(f"頻道 '{self.channel}' 在處理範圍內目前沒有新訊息。")
+        except Exception as e:
+            print(f"錯誤：在估算頻道 '{self.channel}' 的訊息範圍時發生錯誤: {e}")
+            print("這可能是由於網路問題或 Telegram API 暫時性故障。將嘗試繼續處理但無法顯示總進度。")
+
+        # 以上次執行實際測得的每秒訊息數預估完成時間；處理過程中的進度列會改用本次測得的速率
+        if progress and previous_message_rate:
+            estimated_end_time = datetime.datetime.now(TW_TZ) + datetime.timedelta(seconds=progress.estimated_total / previous_message_rate)
+            print(f"[{self.channel}] 依上次執行的速率 ({previous_message_rate:.2f} 則/秒)，預計完成時間：{estimated_end_time.strftime('%Y-%m-%d %H:%M:%S %Z%z')}")
+        elif progress:
+            print(f"[{self.channel}] 沒有上次執行的指標，處理開始後將依實際速率顯示預計剩餘時間。")
+
+        # 4. 處理範圍內的訊息
+        # 單次遍歷：實際處理訊息 (只獲取範圍內的訊息)
+        # 有 min_id 時（增量模式或中途恢復）以 `min_id` + `reverse=True` 從該 ID 之後由舊到新抓取；
+        # 否則以 `offset_date=min_date_to_process - timedelta(seconds=1)` 從範圍開始前一秒往後抓取。
+        # 結合 `msg_date_tw >= max_date_to_process` 的判斷，確保只處理範圍內的訊息，且從舊到新。
+        iter_kwargs = {"reverse": True}
+        if self.min_id:
+            iter_kwargs["min_id"] = self.min_id
+        elif min_date_to_process is not None:
+            iter_kwargs["offset_date"] = min_date_to_process - timedelta(seconds=1)
+        crawl_started = time.monotonic()
+        fetch_started = crawl_started
+        async for msg in iter_messages_adaptive(client, entity, limiter, **iter_kwargs):
+            # 等待下一則訊息的時間（包含限速器的等待）計入 telegram_fetch
+            metrics.record_span("telegram_fetch", time.monotonic() - fetch_started)
+            msg_date_tw = msg.date.astimezone(TW_TZ)
+
+            # 如果訊息日期超出了我們設定的結束日期，就停止處理，因為已經處理完範圍內的訊息。
+            if max_date_to_process and msg_date_tw >= max_date_to_process:
+                break
 
-    # 4. 處理今天的訊息
-    # 第二次遍歷：實際處理訊息 (只獲取今天範圍內的訊息)
-    # `offset_date=MIN_DATE_TO_PROCESS - timedelta(seconds=1)` 和 `reverse=True`
-    # 會讓 Telethon 從 `MIN_DATE_TO_PROCESS` 之前一秒開始往後（時間軸上更晚）抓取訊息。
-    # 結合 `msg_date_tw >= MAX_DATE_TO_PROCESS` 的判斷，確保只處理當天的訊息，且從舊到新。
-    async for msg in client.iter_messages(entity, offset_date=MIN_DATE_TO_PROCESS - timedelta(seconds=1), reverse=True):
-        msg_date_tw = msg.date.astimezone(TW_TZ)
+            self.processed_count += 1
+            metrics.count("messages_processed")
 
-        # 如果訊息日期超出了我們設定的結束日期，就停止處理，因為已經處理完所有當天訊息。
-        if msg_date_tw >= MAX_DATE_TO_PROCESS:
-            break
+            await self.process_message(msg, image_cache, pending_photo_jobs, download_queue)
 
-        processed_count += 1
+            # 顯示進度條 (單行更新，使用 '\r' 回到行首)，預計剩餘時間依本次實際測得的速率計算
+            if progress:
+                remaining = progress.estimated_total * (1 - progress.fraction(msg.id))
+                message_rate = self.processed_count / max(time.monotonic() - crawl_started, 1e-6)
+                print(f"[{self.channel}] 處理進度: {progress.format(self.processed_count, msg.id)}{format_eta(remaining, message_rate)}", end='\r')
+            else:
+                print(f"[{self.channel}] 處理進度: 已處理 {self.processed_count} 筆訊息...", end='\r')
+            fetch_started = time.monotonic()
 
-        msg_date_tw_str = msg_date_tw.strftime('%Y-%m-%d')
+        # 5. 重新檢查已保存的訊息是否被編輯或刪除；失敗時不影響本次新訊息的寫入
+        try:
+            await self.reconcile(limiter, entity, image_cache, pending_photo_jobs, download_queue)
+        except Exception as e:
+            print(f"\n警告：[{self.channel}] 檢查訊息的編輯與刪除時發生錯誤，本次不移除任何貼文: {e}")
+            self.deleted_ids.clear()
+
+        self.completed = True
+
+    async def process_message(self, msg, image_cache: ImageUploadCache, pending_photo_jobs: dict,
+                              download_queue: asyncio.Queue):
+        """
+        把一則訊息轉成貼文：已有圖片連結時沿用，否則以圖片 ID 查詢上傳快取或排入共用的下載佇列。
+        新訊息與重新檢查時發現被編輯的訊息都經過這裡。
+        """
+        msg_date_tw_str = msg.date.astimezone(TW_TZ).strftime('%Y-%m-%d')
         msg_text_original = msg.text or ""
         msg_text_key = msg_text_original.strip()[:50] # 用於查找的文本鍵
 
         img_bb_url = None # 預設為 None
-        current_post_lookup_key = (msg_date_tw_str, msg_text_key)
 
-        # 檢查這條訊息是否已經在舊數據中存在，並且是否有圖片連結。
-        existing_post_data = existing_posts_by_key.get(current_post_lookup_key)
+        # 檢查這條訊息是否已經在資料庫中存在，並且是否有圖片連結。
+        # 以訊息 ID 查詢；沒有 ID 的舊貼文才以 (date, text_key) 匹配，避免開頭相同的不同訊息共用圖片。
+        state = self.store.get_message_states([msg.id]).get(msg.id)
+        existing_post_data = state["post"] if state else self.store.get_by_key(msg_date_tw_str, msg_text_key, without_id=True)
+        if state and msg.photo and state["photo_id"] not in (None, msg.photo.id):
+            existing_post_data = None # 圖片在編輯時被替換，不沿用舊連結
+        if not (existing_post_data and existing_post_data.get("image")) and msg.photo:
+            # 同一張圖片曾出現在其他貼文（例如轉發或修改文字後重發）時，沿用該貼文的圖片
+            existing_post_data = self.store.get_by_photo_id(msg.photo.id)
         if existing_post_data and existing_post_data.get("image"):
             # 如果存在且有圖片連結，則直接使用舊連結，避免重複下載和上傳。
             img_bb_url = existing_post_data["image"]
-            # print(f"訊息 (ID:{msg.id}) 已有圖片連結，跳過上傳。") # 可選：用於除錯
-        elif msg.photo: # 只有當沒有舊連結或舊連結為空，且訊息確實有圖片時，才處理新圖片
-            # 圖片命名邏輯：日期_ID_文本片段.jpg
-            text_snippet = (msg.text or "").strip()
-            if text_snippet:
-                # 移除文件名中不允許的字元
-                text_snippet = re.sub(r'[\\/:*?"<>|]', '', text_snippet)
-                text_snippet = text_snippet.replace(' ', '_')
-                text_snippet = text_snippet[:30] # 限制長度
-                if text_snippet:
-                    text_snippet = f"_{text_snippet}" # 添加下劃線前綴
-            else:
-                text_snippet = ""
-
-            photo_mime_type = 'image/jpeg' # 大多數 Telegram 圖片會是 JPEG
-            file_extension = '.jpg'
-
-            file_name = f"{msg_date_tw_str}_{msg.id}{text_snippet}{file_extension}"
-
-            photo_bytes_io = io.BytesIO() # 創建一個記憶體中的位元組流來儲存圖片
-
-            try:
-                print(f"正在下載訊息 (ID:{msg.id}) 的圖片...")
-                await client.download_media(msg.photo, file=photo_bytes_io)
-                print(f"圖片下載完成，大小：{photo_bytes_io.tell()} bytes。")
-                uploaded_url = await upload_to_imgbb(photo_bytes_io, file_name, photo_mime_type)
-                if uploaded_url:
-                    img_bb_url = uploaded_url
-                    # 只有當圖片成功上傳到 ImgBB 且是當天的訊息時，才設定此標誌
-                    any_new_image_uploaded_today = True
-                else:
-                    print(f"警告：圖片上傳失敗，訊息 (ID:{msg.id}) 將不包含圖片連結。")
-            except Exception as e:
-                print(f"處理訊息 (ID:{msg.id}) 的圖片時發生錯誤: {e}")
-                img_bb_url = None # 確保錯誤時圖片連結為 None
-            finally:
-                photo_bytes_io.close() # 確保關閉記憶體流以釋放資源
 
         # 準備 post_item 字典，包含訊息 ID (用於排序和唯一識別)
+        # 若需要上傳新圖片，上傳 worker 完成後會直接填入 "image"。
         post_item = {
             "id": msg.id, # 訊息 ID，用於唯一識別和排序
             "date": msg_date_tw_str,
             "text": msg_text_original,
             "image": img_bb_url # 這裡直接賦值為 img_bb_url (可能為 None)
         }
-
-        # 將此貼文加入到本次運行處理過的字典中
-        messages_processed_in_this_run_by_key[current_post_lookup_key] = post_item
-
-        # 顯示進度條 (單行更新，使用 '\r' 回到行首)
-        if total_messages_today > 0:
-            percent = (processed_count / total_messages_today) * 100
-            print(f"處理進度: {processed_count}/{total_messages_today} 筆訊息 ({percent:.2f}%)", end='\r')
+        if img_bb_url:
+            # 沿用舊貼文的圖片尺寸與縮圖版本
+            for field in IMAGE_RECORD_FIELDS:
+                if field in existing_post_data:
+                    post_item[field] = existing_post_data[field]
+        self.processed_posts_by_id[msg.id] = post_item
+        if msg.photo:
+            self.photo_ids_by_msg_id[msg.id] = msg.photo.id
+        if msg.edit_date:
+            self.edit_dates_by_msg_id[msg.id] = format_edit_date(msg)
+        self.checkpoint.message_started(msg.id)
+
+        # 只有當沒有舊連結或舊連結為空，且訊息確實有圖片時，才需要處理圖片：
+        # 先以 Telegram 圖片 ID 查詢上傳快取（所有頻道共用），命中時不必下載；否則排入下載佇列
+        photo_key = ImageUploadCache.photo_key(msg.photo) if img_bb_url is None and msg.photo else None
+        cached = image_cache.get(photo_key) if photo_key else None
+        if cached:
+            post_item.update(cached)
+            self.uploaded_urls_by_id[msg.id] = cached["image"]
+            self.checkpoint.message_finished(msg.id, post_item)
+        elif photo_key:
+            job = {
+                "channel_crawl": self,
+                "msg": msg,
+                "post_item": post_item,
+                "photo_key": photo_key,
+                "file_name": build_photo_file_name(msg, msg_date_tw_str),
+                "waiting_jobs": [],
+            }
+            if photo_key in pending_photo_jobs:
+                # 同一張圖片正在處理中（例如其他頻道轉發了同一張圖片），等它完成後沿用結果，不重複下載與上傳
+                pending_photo_jobs[photo_key]["waiting_jobs"].append(job)
+                metrics.count("images_deduplicated")
+            else:
+                pending_photo_jobs[photo_key] = job
+                # 佇列已滿時在此等待；這段時間長代表下載/上傳 worker 不足
+                with metrics.span("pipeline_backpressure"):
+                    await download_queue.put(job)
         else:
-            print(f"處理進度: 已處理 {processed_count} 筆訊息...", end='\r')
-
-        await asyncio.sleep(0.1) # 添加短暫延遲，避免過於頻繁請求 Telegram API
+            self.checkpoint.message_finished(msg.id, post_item)
+
+    async def reconcile(self, limiter: AdaptiveRateLimiter, entity, image_cache: ImageUploadCache,
+                        pending_photo_jobs: dict, download_queue: asyncio.Queue):
+        """
+        以訊息 ID 重新取得已保存的訊息（每 RECONCILE_BATCH_SIZE 則一次請求），找出在 Telegram 上被編輯或刪除的訊息。
+        被編輯的訊息重新處理（圖片沒有被替換時沿用舊連結），刪除則記錄下來，在 write() 時從資料庫移除。
+        整批都取不到訊息時（例如暫時失去頻道的存取權）不視為刪除。
+        """
+        if self.reconcile_mode == "off":
+            return
+        client = get_client()
+        if self.reconcile_mode == "all":
+            msg_ids = self.store.message_ids()
+        else:
+            since_date = (datetime.datetime.now(TW_TZ) - timedelta(days=RECONCILE_DAYS)).strftime('%Y-%m-%d')
+            msg_ids = self.store.message_ids(since_date=since_date)
+            # 較舊的訊息切成每段 older_limit 則，依日期輪流檢查其中一段，輪完後從最新的一段重新開始。
+            # 以日期決定而不是記錄在檢查點中，crawl_state.json 不會因為輪替位置每天改變
+            older_limit = RECONCILE_OLDER_BATCHES * RECONCILE_BATCH_SIZE
+            if older_limit:
+                older_ids = self.store.message_ids(before_id=min(msg_ids, default=None))
+                slice_count = max(1, -(-len(older_ids) // older_limit))
+                start = datetime.datetime.now(TW_TZ).date().toordinal() % slice_count * older_limit
+                msg_ids = msg_ids + older_ids[start:start + older_limit]
+        # 本次已經處理過的訊息不必再檢查
+        msg_ids = [msg_id for msg_id in msg_ids if msg_id not in self.processed_posts_by_id]
+        if not msg_ids:
+            return
+
+        print(f"\n[{self.channel}] 正在檢查 {len(msg_ids)} 則已保存的訊息是否被編輯或刪除...")
+        states = self.store.get_message_states(msg_ids)
+        missing_ids = []
+        found_count = 0
+        for start in range(0, len(msg_ids), RECONCILE_BATCH_SIZE):
+            batch = msg_ids[start:start + RECONCILE_BATCH_SIZE]
+            with metrics.span("telegram_reconcile"):
+                messages = await limiter.call(client.get_messages, entity, ids=batch)
+            for msg_id, msg in zip(batch, messages):
+                if msg is None:
+                    missing_ids.append(msg_id)
+                    continue
+                found_count += 1
+                if not message_changed(msg, states[msg_id]):
+                    # 內容沒有改變，只記錄圖片 ID 與編輯時間，下次可直接以編輯時間判斷
+                    if msg.photo:
+                        self.photo_ids_by_msg_id[msg_id] = msg.photo.id
+                    if msg.edit_date:
+                        self.edit_dates_by_msg_id[msg_id] = format_edit_date(msg)
+                    continue
+                self.edited_ids.add(msg_id)
+                metrics.count("messages_edited")
+                await self.process_message(msg, image_cache, pending_photo_jobs, download_queue)
+        metrics.count("messages_reconciled", len(msg_ids))
+
+        if missing_ids and not found_count:
+            print(f"[{self.channel}] 警告：{len(missing_ids)} 則訊息都無法取得，可能是暫時無法存取頻道，本次不移除任何貼文。")
+            missing_ids = []
+        self.deleted_ids.update(missing_ids)
+        metrics.count("messages_deleted", len(missing_ids))
+        print(f"[{self.channel}] 已檢查 {len(msg_ids)} 則訊息：{len(self.edited_ids)} 則被編輯，{len(missing_ids)} 則已被刪除。")
+
+    def write(self, is_default_run: bool) -> bool:
+        """
+        寫入這個頻道的 posts.json、月份分片與搜尋索引，並更新檢查點。
+        回傳是否有新的圖片貼文，用於決定是否發送推播通知。
+        """
+        # 上次中斷前已上傳的圖片同樣算作本次新增的圖片
+        any_new_image_uploaded_today = bool(self.uploaded_urls_by_id) or any(post.get("image") for post in self.resumed_posts)
+
+        # 5. 根據是否有成功上傳的圖片來決定是否寫入 JSON
+        # 增量模式與指定日期範圍時，只要有處理到訊息就寫入，確保高水位線不會越過未寫入的貼文。
+        # 被編輯或刪除的訊息不論執行模式都要寫入，網站上才不會留著舊的內容
+        should_write = (any_new_image_uploaded_today or bool(self.edited_ids) or bool(self.deleted_ids)
+                        or (not is_default_run and bool(self.processed_posts_by_id)))
+        write_succeeded = True
+        if should_write:
+            print(f"[{self.channel}] 檢測到有新的貼文、成功上傳的圖片或被編輯/刪除的訊息，將寫入 JSON。")
+
+            # 依訊息 ID 由舊到新 upsert 到資料庫（以訊息 ID 為鍵，被編輯的訊息會更新原本的貼文），
+            # 再移除已在 Telegram 上被刪除的訊息。
+            try:
+                with metrics.span("store_upsert"):
+                    touched_months = self.store.upsert_posts(
+                        (self.processed_posts_by_id[msg_id] for msg_id in sorted(self.processed_posts_by_id)),
+                        photo_ids=self.photo_ids_by_msg_id,
+                        edit_dates=self.edit_dates_by_msg_id,
+                    )
+                    if self.deleted_ids:
+                        print(f"[{self.channel}] 正在移除 {len(self.deleted_ids)} 則已被刪除的訊息...")
+                        touched_months |= self.store.delete_by_message_ids(sorted(self.deleted_ids))
+                print(f"[{self.channel}] 共 {self.store.count()} 筆資料，正在從資料庫重新產生 {self.output_json_file} ...")
+                # posts.json 依日期降序、同一天依訊息 ID 降序輸出；月份分片只重新產生本次改動的月份
+                shard_dir = self.target.path(POSTS_SHARD_DIR)
+                print(f"正在更新 {shard_dir}/ 下的月份分片...")
+                with metrics.span("export"):
+                    self.store.export(self.output_json_file, months=touched_months, shard_dir=shard_dir,
+                                      index_dir=self.target.path(SEARCH_INDEX_DIR))
+                print("完成！數據已成功儲存。")
+            except Exception as e:
+                write_succeeded = False
+                print(f"錯誤：寫入 {self.output_json_file} 失敗: {e}")
+        else:
+            print(f"[{self.channel}] 沒有新的圖片成功上傳，因此跳過寫入 JSON 檔案。")
+            # 沒有改變的訊息仍記錄圖片 ID 與編輯時間（不輸出到 posts.json，保存在資料庫與 posts-meta.jsonl）
+            self.store.update_message_meta(self.photo_ids_by_msg_id, self.edit_dates_by_msg_id)
+            self.store.export_meta(post_meta_path(self.output_json_file))
+
+        # 6. 更新檢查點：寫入成功後清空中途進度；增量模式下推進高水位線
+        if write_succeeded:
+            self.checkpoint.commit(max([self.min_id, *self.processed_posts_by_id]) if self.incremental else None)
+        else:
+            self.checkpoint.save() # 保留已處理的貼文，下次執行時重新合併
+        self.store.close()
+        return should_write and any_new_image_uploaded_today
 
-    print("\n") # 處理完成後打印一個換行符，確保後續輸出從新行開始
+    def close(self):
+        """遍歷中途失敗：保存已連續處理完成的貼文，下次可從中斷處繼續。"""
+        self.checkpoint.save()
+        self.store.close()
 
-    # 5. 根據是否有當天成功上傳的圖片來決定是否寫入 JSON 和發送通知
-    if any_new_image_uploaded_today:
-        print("檢測到今天有成功上傳的圖片，將寫入 JSON 並發送通知。")
+# --- 主要處理流程函式 ---
+async def main(since: datetime.date | None = None, until: datetime.date | None = None, incremental: bool = False,
+               targets: list | None = None, reconcile: str = "recent"):
+    """
+    since/until：只處理指定日期範圍（台灣時區，包含兩端）的訊息，用於補抓漏掉的日子。
+    incremental：只處理比檢查點高水位線更新的訊息（以 min_id 查詢），不受日期限制。
+    都未指定時維持原本行為，只處理今天的訊息。
+    targets：要爬取的頻道（ChannelTarget），預設為 CHANNEL_USERNAME 列出的所有頻道。
+    reconcile：重新檢查已保存訊息的編輯與刪除的範圍（recent、all 或 off，見 RECONCILE_MODES）。
+    所有頻道共用同一個 Telethon 連線、限速器、圖片上傳快取與下載/上傳 worker，並行爬取。
+    必要的環境變數缺少時拋出 ConfigError。
+    """
+    import requests
 
-        # 合併所有數據並寫入 JSON 檔案
-        # 使用字典來進行精確的合併和去重，以 (date, text_key) 為主要鍵。
-        final_posts_map = {}
+    print(f"\n--- 腳本開始運行於：{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ---")
+    # 上次執行實際測得的處理速率，用於在開始前估算完成時間
+    previous_message_rate = load_previous_rate(METRICS_FILE, "messages_processed")
+    metrics.start()
+    targets = targets or load_channel_targets()
+    client = get_client()
+
+    # 0. 決定本次要處理的範圍
+    is_default_run = not incremental and since is None and until is None
+    if incremental:
+        min_date_to_process, max_date_to_process = None, None
+        run_key = "incremental"
+    else:
+        min_date_to_process, max_date_to_process = build_date_window(since, until)
+        run_key = f"{min_date_to_process.strftime('%Y-%m-%d')}~{(max_date_to_process - timedelta(days=1)).strftime('%Y-%m-%d')}"
+        print(f"設定處理日期範圍：從 {min_date_to_process.strftime('%Y-%m-%d %H:%M:%S %Z%z')} 到 {max_date_to_process.strftime('%Y-%m-%d %H:%M:%S %Z%z')}")
 
-        # 1. 將所有舊數據放入合併字典，作為基礎數據
-        for post_key, post_data in existing_posts_by_key.items():
-            final_posts_map[post_key] = post_data
+    # 1. 各頻道開啟自己的貼文資料庫與檢查點
+    print(f"本次共爬取 {len(targets)} 個頻道：{', '.join(f'{target.channel} -> {target.output_dir}' for target in targets)}")
+    crawls = [ChannelCrawl(target, run_key, incremental, reconcile) for target in targets]
 
-        # 2. 將本次運行處理的所有訊息（新的或更新的）覆蓋或添加到合併字典中
-        # 如果 `current_post_lookup_key` 相同，則 `messages_processed_in_this_run_by_key` 中的數據會覆蓋 `existing_posts_by_key` 中的數據
-        final_posts_map.update(messages_processed_in_this_run_by_key)
+    # 2. 連接 Telegram：所有頻道共用同一個已登入的客戶端，只需連線與驗證一次
+    try:
+        print("正在嘗試連接 Telegram...")
 
-        # 3. 將合併後的字典值轉換為列表
-        final_posts = list(final_posts_map.values())
+        # 檢查 Telethon 客戶端是否成功登入 (使用了 Session)。
+        # 嘗試獲取自己的信息是確認 Telethon Session 是否成功載入並授權的最佳方式。
+        with metrics.span("telegram_connect"):
+            me = await client.get_me()
+        print(f"Telethon 客戶端已成功登入為：{me.first_name} {me.last_name if me.last_name else ''} (ID: {me.id})")
 
-        # 4. 對所有數據進行排序：首先按日期降序，如果日期相同，則按訊息 ID 降序 (最新的在最上面)
-        # 這樣確保了 JSON 檔案中的貼文是從最新到最舊排列的。
-        final_posts.sort(key=lambda x: (
-            datetime.datetime.strptime(x['date'], '%Y-%m-%d'),
-            x.get('id', 0) # 如果有 id 則用 id 排序，否則用 0 (確保穩定性，舊數據可能沒有 id 欄位)
-        ), reverse=True) # 關鍵的 reverse=True 實現降序排列
+        # 讓 FloodWait 直接拋出，交由自適應限速器處理（等待後從中斷處繼續）
+        client.flood_sleep_threshold = 0
+    except Exception as e:
+        print(f"錯誤：無法連接 Telegram: {e}")
+        print("請確保您的 Telegram 帳號狀態正常，且 anon.session 有效。")
+        print("如果您遇到 PhoneNumberBannedError，可能需要檢查您的帳號狀態或更換帳號。")
+        print(f"--- 腳本結束於：{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ---")
+        for crawl in crawls:
+            crawl.store.close()
+        return # 終止腳本執行
 
-        print(f"共擷取並準備寫入 {len(final_posts)} 筆資料到 {OUTPUT_JSON_FILE}。")
+    # 自適應限速器：只有在 FloodWait 或 Telegram 回應變慢時才退避，取代每則訊息固定的 sleep。
+    # 所有頻道共用同一份速率預算：FloodWait 針對整個帳號，任何頻道遇到時全部一起暫停。
+    limiter = AdaptiveRateLimiter(metrics=metrics, max_concurrency=TELEGRAM_MAX_CONCURRENCY)
+
+    # 已上傳圖片的快取：在下載前以圖片 ID 查詢，避免重新下載與重新上傳；所有頻道共用，跨頻道轉發的圖片只上傳一次
+    image_cache = ImageUploadCache()
+    # 正在下載/上傳中的圖片：圖片鍵 -> 任務，其他頻道遇到同一張圖片時排在它後面等待結果
+    pending_photo_jobs = {}
+
+    # 各頻道的訊息遍歷作為生產者，把需要處理的圖片放入共用的下載佇列；
+    # 下載、圖片最佳化與上傳 worker 同時運行，讓 Telegram 下載、圖片編碼與圖片上傳互相重疊。
+    download_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    optimize_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    upload_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    # 圖片編碼在獨立的行程中執行，不受 GIL 限制
+    image_pool = concurrent.futures.ProcessPoolExecutor(max_workers=IMAGE_PROCESS_WORKERS) if ENABLE_IMAGE_VARIANTS else None
+
+    # 圖片儲存後端：ImgBB 在整個執行中共用一個連線池，暫時性錯誤會自動重試；local 模式直接寫入 images/
+    async with build_image_storage() as storage:
+        download_tasks = [asyncio.create_task(download_worker(limiter, image_cache, pending_photo_jobs, download_queue, optimize_queue)) for _ in range(DOWNLOAD_WORKERS)]
+        optimize_tasks = [asyncio.create_task(optimize_worker(image_pool, optimize_queue, upload_queue)) for _ in range(IMAGE_PROCESS_WORKERS)]
+        upload_tasks = [asyncio.create_task(upload_worker(storage, image_cache, pending_photo_jobs, upload_queue)) for _ in range(UPLOAD_WORKERS)]
+        # 遍歷與結束時的等待都同時監看 worker：任何 worker 意外中止時立即失敗，不會卡在有界佇列上
+        worker_tasks = download_tasks + optimize_tasks + upload_tasks
 
-        print(f"正在寫入 {OUTPUT_JSON_FILE} ...")
         try:
-            with open(OUTPUT_JSON_FILE, "w", encoding="utf-8") as f:
-                # ensure_ascii=False 允許寫入非 ASCII 字元 (如中文) 而不轉義
-                # indent=2 使 JSON 輸出格式化，更易於閱讀
-                json.dump(final_posts, f, ensure_ascii=False, indent=2)
-            print("完成！數據已成功儲存。")
-        except Exception as e:
-            print(f"錯誤：寫入 {OUTPUT_JSON_FILE} 失敗: {e}")
+            # 各頻道同時遍歷；某個頻道失敗不會中斷其他頻道
+            results = await supervise_workers(asyncio.gather(*(
+                crawl.crawl(limiter, image_cache, pending_photo_jobs, download_queue,
+                            min_date_to_process, max_date_to_process, previous_message_rate)
+                for crawl in crawls
+            ), return_exceptions=True), worker_tasks)
+        finally:
+            # 無論遍歷是否成功，都通知 worker 結束並等待佇列中的任務處理完畢
+            try:
+                if not any(task.done() for task in worker_tasks): # worker 已被取消時不需要再通知
+                    with metrics.span("pipeline_drain"):
+                        await supervise_workers(drain_pipeline([
+                            (download_queue, download_tasks),
+                            (optimize_queue, optimize_tasks),
+                            (upload_queue, upload_tasks),
+                        ]), worker_tasks)
+            finally:
+                if image_pool is not None:
+                    image_pool.shutdown()
+                image_cache.save()
+
+    errors = []
+    for crawl, result in zip(crawls, results):
+        if isinstance(result, BaseException):
+            print(f"\n錯誤：頻道 '{crawl.channel}' 在遍歷訊息時中斷: {result}")
+            errors.append(result)
+
+    if image_cache.hits:
+        print(f"\n圖片上傳快取命中 {image_cache.hits} 次，省去重複的下載或上傳。")
+        metrics.count("image_cache_hits", image_cache.hits)
+    if limiter.flood_wait_count:
+        print(f"\n本次共遇到 {limiter.flood_wait_count} 次 FloodWait，累計等待 {limiter.flood_wait_seconds_total} 秒。")
 
+    print("\n") # 處理完成後打印一個換行符，確保後續輸出從新行開始
+
+    # 5~6. 寫入各頻道的輸出檔並更新檢查點；中途失敗的頻道只保存檢查點，下次從中斷處繼續
+    should_notify = False
+    for crawl in crawls:
+        if not crawl.completed:
+            crawl.close()
+            continue
+        if crawl.write(is_default_run) and crawl.target.is_site_root:
+            should_notify = True
+
+    # 只有網站使用的 posts.json 有新的圖片貼文時才發送推播通知
+    if should_notify:
         # 發送推播通知前新增等待時間
-        print("等待 10 秒後發送每日通知...")
-        await asyncio.sleep(10) # 增加 10 秒等待時間
+        print(f"等待 {NOTIFICATION_DELAY_SECONDS} 秒後發送每日通知...")
+        await asyncio.sleep(NOTIFICATION_DELAY_SECONDS)
 
         try:
-            requests.post(
-                "https://jigong-news-backend.onrender.com/api/send-daily-notification",
-                headers={"Content-Type": "application/json"},
-                json={}
-            )
+            with metrics.span("notification"):
+                requests.post(
+                    NOTIFICATION_URL,
+                    headers={"Content-Type": "application/json"},
+                    json={}
+                )
             print("每日通知已發送。")
         except requests.exceptions.RequestException as e:
             print(f"發送每日通知失敗: {e}")
         except Exception as e:
             print(f"發送每日通知時發生意外錯誤: {e}")
-
     else:
-        print("今天沒有新的圖片成功上傳到 ImgBB，因此跳過寫入 JSON 檔案和發送每日通知。")
+        print("網站的 posts.json 沒有新的圖片貼文，跳過發送每日通知。")
+
+    # 7. 輸出本次執行的指標，供找出變慢的階段與調整並行數量
+    print("各階段耗時：")
+    for line in metrics.summary_lines():
+        print(line)
+    try:
+        metrics.write(METRICS_FILE)
+        print(f"執行指標已寫入 {METRICS_FILE}。")
+    except Exception as e:
+        print(f"警告：寫入執行指標 {METRICS_FILE} 失敗: {e}")
 
-    end_time = time.time() # 記錄腳本結束運行時間
-    total_duration = end_time - start_time
     print(f"--- 腳本結束運行於：{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ---")
-    print(f"總耗時：{total_duration:.2f} 秒")
+    print(f"總耗時：{metrics.elapsed:.2f} 秒")
+
+    # 其他頻道已正常寫入；讓排程仍以失敗結束，方便發現問題
+    if errors:
+        raise errors[0]
 
 
 # --- 運行主程式 ---
-# 使用 `with client:` 語法確保 Telethon 客戶端正確連接和斷開。
-# `client.loop.run_until_complete(main())` 運行異步的 `main` 函數。
-if __name__ == "__main__":
+def run(since: datetime.date | None = None, until: datetime.date | None = None, incremental: bool = False,
+        reconcile: str = "recent"):
+    """
+    同步執行 main()：先檢查設定，再使用 `with client:` 語法確保 Telethon 客戶端正確連接和斷開。
+    設定有誤時拋出 ConfigError。
+    """
+    targets = load_channel_targets()
+    client = get_client()
     with client:
-        client.loop.run_until_complete(main())
+        client.loop.run_until_complete(main(since=since, until=until, incremental=incremental, targets=targets,
+                                                 reconcile=reconcile))
+
+
+# 直接執行本檔等同於 `python cli.py daily ...`，命令列參數與 .env 的載入都由 cli.py 處理
+if __name__ == "__main__":
+    from cli import main as cli_main
+    sys.exit(cli_main(["daily", *sys.argv[1:]]))
@@ -1,73 +1,204 @@
 #把歷史貼爬取下來
-from telethon import TelegramClient
-import json
+# 將訊息 ID 空間切成多個區段，在同一個 Telegram 客戶端上並行抓取，
+# 每批結果直接 upsert 到貼文資料庫，並記錄各區段的進度，中斷後可從各區段的位置繼續。
+# 與 everypy.py 相同，匯入時沒有副作用；命令列請執行 `python cli.py backfill`（或直接執行本檔）。
+import asyncio
 import os
+import sys
+import time
 from datetime import timezone, timedelta
 
-api_id = 24497815
-api_hash = 'a97f0ae369dae84561e49303c377ced5'
-channel = 'jigongnews'
-output_filename = "posts.json"
+from crawl_utils import AdaptiveRateLimiter, BackfillState, iter_messages_adaptive
+from metrics import RunMetrics, format_eta
+from post_store import POST_STORE_FILE, PostStore
+from settings import create_telegram_client, load_env
 
-client = TelegramClient('anon', api_id, api_hash)
+output_filename = "posts.json"
+BACKFILL_STATE_FILE = "backfill_state.json" # 各區段的回補進度
+METRICS_FILE = os.getenv("BACKFILL_METRICS_FILE", "backfill_metrics.json") # 本次回補的各階段耗時與計數器
+BACKFILL_PARTITION_SIZE = int(os.getenv("BACKFILL_PARTITION_SIZE", "500")) # 每個區段涵蓋的訊息 ID 數量
+BACKFILL_CONCURRENCY = int(os.getenv("BACKFILL_CONCURRENCY", "4")) # 同時抓取的區段數量
+BACKFILL_BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE", "100")) # 每累積多少則訊息寫入資料庫並記錄進度一次
+# 除了 "image" 之外，和圖片相關、需要隨圖片連結一起沿用的欄位
+IMAGE_RECORD_FIELDS = ("width", "height", "variants")
 
 # 台灣時區
 TW_TZ = timezone(timedelta(hours=8))
 
-async def main():
-    existing_images_lookup = {}
-    if os.path.exists(output_filename):
-        print(f"正在讀取現有的 {output_filename} 以保留圖片資訊...")
-        try:
-            with open(output_filename, "r", encoding="utf-8") as f:
-                existing_data = json.load(f)
-            for post in existing_data:
-                # 使用 (日期, 文本摘要) 作為鍵來查找，文本摘要僅用於查找
-                text_key = (post.get("text") or "").strip()[:50] # 取前50字符作為簡化鍵
-                existing_images_lookup[(post.get("date"), text_key)] = post.get("image")
-            print(f"已讀取 {len(existing_images_lookup)} 筆舊貼文的圖片資訊。")
-        except Exception as e:
-            print(f"讀取或處理 {output_filename} 失敗: {e}。將不保留舊圖片資訊。")
-
-    posts = []
-    # os.makedirs("images", exist_ok=True) # 註解掉創建圖片資料夾的功能
-    print("正在取得訊息總數...")
-    # 先取得總數
-    total = 0
-    async for _ in client.iter_messages(channel):
-        total += 1
-    print(f"總共 {total} 筆訊息，開始處理...")
-
-    count = 0
-    async for msg in client.iter_messages(channel):
-        # 將訊息時間轉換為台灣時區的 YYYY-MM-DD 格式字串
-        msg_date_tw_str = msg.date.astimezone(TW_TZ).strftime('%Y-%m-%d')
-        msg_text_original = msg.text or ""
-        msg_text_key = msg_text_original.strip()[:50] # 用於查找的文本鍵
-
-        current_image_path = None
-        # if msg.photo: # 註解掉圖片下載相關邏輯
-            # filename = f"images/{msg.date.strftime('%Y-%m-%d')}_{msg.id}.jpg"
-            # print(f"下載圖片：{filename}")
-            # image_path = await client.download_media(msg.photo, file=filename)
-            # pass # 如果有照片，但我們不下載，則 image_path 保持為 None
-        
-        # 查找現有圖片資訊
-        if (msg_date_tw_str, msg_text_key) in existing_images_lookup:
-            current_image_path = existing_images_lookup[(msg_date_tw_str, msg_text_key)]
-        
-        posts.append({
-            "date": msg_date_tw_str, # 使用台灣時區日期
-            "text": msg_text_original,
-            "image": current_image_path # 保留舊資料的image值，若無則為null
-        })
-        count += 1
-        percent = (count / total) * 100
-        print(f"已處理 {count}/{total} 筆訊息 ({percent:.2f}%)", end='\r')
-    print(f"\n共擷取到 {len(posts)} 筆資料，正在寫入 {output_filename} ...")
-    with open(output_filename, "w", encoding="utf-8") as f:
-        json.dump(posts, f, ensure_ascii=False, indent=2)
-    print("完成！")
-
-with client:
-    client.loop.run_until_complete(main())
\ No newline at end of file
+
+def build_post(msg, store: PostStore) -> dict:
+    # 將訊息時間轉換為台灣時區的 YYYY-MM-DD 格式字串
+    msg_date_tw_str = msg.date.astimezone(TW_TZ).strftime('%Y-%m-%d')
+    msg_text_original = msg.text or ""
+    msg_text_key = msg_text_original.strip()[:50] # 用於查找的文本鍵
+
+    # 查找現有圖片資訊（回補只抓文字，不下載圖片）
+    current_image_path = None
+    # 以訊息 ID 查詢；沒有 ID 的舊貼文才以 (date, text_key) 匹配
+    existing_post = store.get_by_message_id(msg.id) or store.get_by_key(msg_date_tw_str, msg_text_key, without_id=True)
+    if existing_post:
+        current_image_path = existing_post.get("image")
+
+    post = {
+        "id": msg.id, # 訊息 ID，用於同一天內的排序
+        "date": msg_date_tw_str, # 使用台灣時區日期
+        "text": msg_text_original,
+        "image": current_image_path # 保留舊資料的image值，若無則為null
+    }
+    if current_image_path:
+        # 保留圖片尺寸與縮圖版本
+        for field in IMAGE_RECORD_FIELDS:
+            if field in existing_post:
+                post[field] = existing_post[field]
+    return post
+
+
+class BackfillProgress:
+    def __init__(self, total: int, metrics: RunMetrics):
+        self.total = total
+        self.count = 0
+        self.metrics = metrics
+
+    def add(self, n: int):
+        self.count += n
+        self.metrics.count("messages_processed", n)
+        # 預計剩餘時間依本次實際測得的速率計算
+        eta = format_eta(self.total - self.count, self.metrics.rate("messages_processed"))
+        print(f"已處理 {self.count}/~{self.total} 筆訊息 ({min(1.0, self.count / self.total) * 100:.2f}%){eta}", end='\r')
+
+
+async def backfill_partition(client, channel, limiter, store, state, partition, progress, metrics):
+    """
+    由舊到新抓取一個區段內的訊息。每 BACKFILL_BATCH_SIZE 則訊息 upsert 一次並記錄進度，
+    記憶體中最多只保留一批貼文。
+    資料庫中位於已抓取範圍內、但這次沒有抓到的訊息已在 Telegram 上被刪除，同時從資料庫移除；
+    每批只處理上次進度到這批最後一則之間的範圍，中斷後繼續也不會誤刪尚未抓取的訊息。
+    """
+    batch = []
+    photo_ids = {}
+    edit_dates = {}
+
+    def delete_missing(last_id: int):
+        """刪除資料庫中 ID 介於 next_id 與 last_id（含）之間、但不在本批的訊息。"""
+        seen_ids = {post["id"] for post in batch}
+        missing_ids = [msg_id for msg_id in store.message_ids(min_id=partition["next_id"], before_id=last_id + 1)
+                       if msg_id not in seen_ids]
+        if missing_ids:
+            store.delete_by_message_ids(missing_ids)
+            metrics.count("messages_deleted", len(missing_ids))
+
+    def flush():
+        if not batch:
+            return
+        with metrics.span("store_upsert"):
+            store.upsert_posts(batch, photo_ids=photo_ids, edit_dates=edit_dates)
+            delete_missing(batch[-1]["id"])
+        state.advance(partition, batch[-1]["id"])
+        state.save()
+        progress.add(len(batch))
+        batch.clear()
+        photo_ids.clear()
+        edit_dates.clear()
+
+    # min_id/max_id 不包含兩端；reverse=True 讓訊息由舊到新，進度只需記錄最後處理的 ID
+    fetch_started = time.monotonic()
+    async for msg in iter_messages_adaptive(client, channel, limiter, wait_time=0, reverse=True,
+                                            min_id=partition["next_id"] - 1, max_id=partition["high"] + 1):
+        metrics.record_span("telegram_fetch", time.monotonic() - fetch_started)
+        batch.append(build_post(msg, store))
+        if msg.photo:
+            photo_ids[msg.id] = msg.photo.id
+        if msg.edit_date:
+            edit_dates[msg.id] = msg.edit_date.isoformat()
+        if len(batch) >= BACKFILL_BATCH_SIZE:
+            flush()
+        fetch_started = time.monotonic()
+    flush()
+    delete_missing(partition["high"]) # 區段內最後一則抓到的訊息之後，資料庫中剩下的都已被刪除
+    state.finish(partition)
+    state.save()
+
+
+async def main(client, channel, restart=False):
+    metrics = RunMetrics()
+    # 以貼文資料庫查詢現有圖片資訊（資料庫不存在時會從 posts.json 匯入一次），不必把整個 posts.json 載入成查找字典
+    store = PostStore(POST_STORE_FILE, bootstrap_json=output_filename)
+    print(f"貼文資料庫 {POST_STORE_FILE} 目前共有 {store.count()} 筆貼文。")
+
+    state = BackfillState(BACKFILL_STATE_FILE, channel, BACKFILL_PARTITION_SIZE)
+    if restart:
+        state.partitions = []
+
+    # 以最新一則訊息的 ID 切分區段與估算總數，取代先完整遍歷一次頻道的計數步驟
+    print("正在取得最新訊息 ID...")
+    latest = await client.get_messages(channel, limit=1)
+    if not latest:
+        print("頻道中沒有任何訊息。")
+        store.close()
+        return
+    if state.is_resumed:
+        print(f"從 {BACKFILL_STATE_FILE} 繼續上次中斷的回補。")
+    state.extend_to(latest[0].id)
+    state.save()
+
+    pending = state.pending_partitions()
+    remaining = sum(partition["high"] - partition["next_id"] + 1 for partition in pending)
+    print(f"共 {len(state.partitions)} 個區段，尚有 {len(pending)} 個區段、約 {remaining} 筆訊息待處理，"
+          f"同時抓取 {BACKFILL_CONCURRENCY} 個區段...")
+
+    # 讓 FloodWait 直接拋出，交由共用的自適應限速器處理；wait_time=0 取消 Telethon 每頁固定 1 秒的等待
+    client.flood_sleep_threshold = 0
+    limiter = AdaptiveRateLimiter(metrics=metrics)
+    progress = BackfillProgress(max(remaining, 1), metrics)
+
+    partition_queue = asyncio.Queue()
+    for partition in pending:
+        partition_queue.put_nowait(partition)
+
+    async def worker():
+        while not partition_queue.empty():
+            partition = partition_queue.get_nowait()
+            await backfill_partition(client, channel, limiter, store, state, partition, progress, metrics)
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(BACKFILL_CONCURRENCY, len(pending)) or 1)]
+    try:
+        await asyncio.gather(*workers)
+    except BaseException:
+        # 任一區段失敗時停止其他區段；每批寫入與進度記錄之間沒有 await，不會留下不一致的進度
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        print(f"\n回補中斷，已完成的批次已寫入 {POST_STORE_FILE}，重新執行會從 {BACKFILL_STATE_FILE} 記錄的位置繼續。")
+        store.close()
+        metrics.write(METRICS_FILE)
+        raise
+
+    if limiter.flood_wait_count:
+        print(f"\n本次共遇到 {limiter.flood_wait_count} 次 FloodWait，累計等待 {limiter.flood_wait_seconds_total} 秒。")
+    print(f"\n回補完成，資料庫共 {store.count()} 筆資料，正在寫入 {output_filename} ...")
+    # 完整重建 posts.json、所有分片與搜尋索引（包含刪除了訊息的月份）
+    with metrics.span("export"):
+        store.export(output_filename)
+    store.close()
+    state.clear()
+    print("完成！各階段耗時：")
+    for line in metrics.summary_lines():
+        print(line)
+    metrics.write(METRICS_FILE)
+    print(f"執行指標已寫入 {METRICS_FILE}。")
+
+
+def run(restart: bool = False):
+    """同步執行回補：建立客戶端並以 `with client:` 確保正確連接和斷開。設定有誤時拋出 ConfigError。"""
+    load_env()
+    # CHANNEL_USERNAME 列出多個頻道時（見 everypy.parse_channel_targets），回補第一個、也就是網站使用的頻道
+    channel = os.getenv("CHANNEL_USERNAME", "jigongnews").split(",")[0].partition("=")[0].strip()
+    client = create_telegram_client()
+    with client:
+        client.loop.run_until_complete(main(client, channel, restart=restart))
+
+
+# 直接執行本檔等同於 `python cli.py backfill ...`
+if __name__ == "__main__":
+    from cli import main as cli_main
+    sys.exit(cli_main(["backfill", *sys.argv[1:]]))
@@ -0,0 +1,76 @@
+# 已上傳圖片的本地快取：以 Telegram 圖片 ID 與圖片內容雜湊對應到上傳後的連結
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+IMAGE_CACHE_FILE = "image_cache.json"
+IMAGE_CACHE_MAX_ENTRIES = int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", "5000"))
+
+
+class ImageUploadCache:
+    """
+    以內容定址的圖片上傳快取。每張圖片會以兩個鍵記錄：
+      - photo:<id>:<access_hash>：Telegram 圖片本身的 ID，下載前即可查詢，轉發或重複發佈的圖片會共用同一個 ID。
+      - sha256:<digest>：下載後的位元組雜湊，能辨識重新上傳到 Telegram、但內容完全相同的圖片。
+    值為上傳結果字典（至少包含 "image"）。超過 max_entries 時依最近最少使用 (LRU) 的順序淘汰。
+    """
+
+    def __init__(self, path: str = IMAGE_CACHE_FILE, max_entries: int = IMAGE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = OrderedDict() # 鍵 -> 上傳結果，越後面代表越近期使用
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                for key, value in data.get("entries", []):
+                    self.entries[key] = value
+                print(f"已讀取圖片上傳快取 {path}，共 {len(self.entries)} 筆記錄。")
+            except Exception as e:
+                print(f"警告：讀取圖片上傳快取 {path} 失敗: {e}。將使用空的快取。")
+                self.entries = OrderedDict()
+
+    @staticmethod
+    def photo_key(photo) -> str:
+        return f"photo:{photo.id}:{photo.access_hash}"
+
+    @staticmethod
+    def content_key(data: bytes) -> str:
+        return f"sha256:{hashlib.sha256(data).hexdigest()}"
+
+    def get(self, key: str) -> dict | None:
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self._dirty = True
+        self.hits += 1
+        return value
+
+    def put(self, keys: list, value: dict):
+        for key in keys:
+            if key:
+                self.entries[key] = value
+                self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self._dirty = True
+
+    def save(self):
+        if not self._dirty and os.path.exists(self.path):
+            return
+        data = {
+            "entries": [[key, value] for key, value in self.entries.items()],
+        }
+        # 先寫入暫存檔再替換，避免崩潰時留下寫了一半的快取
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        os.replace(temp_path, self.path)
+        self._dirty = False
@@ -0,0 +1,237 @@
+# 圖片儲存後端：ImgBB（共用連線池、有上限的重試與隨機退避）或本機目錄（以內容雜湊命名，批次 fsync）
+import abc
+import asyncio
+import hashlib
+import os
+import random
+from contextlib import nullcontext
+
+IMAGE_STORAGE = os.getenv("IMAGE_STORAGE", "imgbb") # "imgbb" 或 "local"
+IMAGE_STORAGE_DIR = os.getenv("IMAGE_STORAGE_DIR", "images") # local 模式的輸出目錄，網站以相對路徑提供
+IMGBB_UPLOAD_URL = "https://api.imgbb.com/1/upload"
+UPLOAD_MAX_RETRIES = int(os.getenv("UPLOAD_MAX_RETRIES", "4")) # 暫時性錯誤最多重試幾次
+UPLOAD_BACKOFF_BASE = float(os.getenv("UPLOAD_BACKOFF_BASE", "1.0")) # 第一次重試前最多等待的秒數，之後每次加倍
+UPLOAD_BACKOFF_MAX = float(os.getenv("UPLOAD_BACKOFF_MAX", "30.0"))
+LOCAL_FSYNC_BATCH = int(os.getenv("LOCAL_FSYNC_BATCH", "32")) # local 模式每寫入多少個檔案 fsync 一次
+
+# 這些 HTTP 狀態碼代表暫時性錯誤，值得重試；其他 4xx（例如 API key 錯誤）重試也不會成功
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class ImageStorage(abc.ABC):
+    """
+    圖片儲存後端的介面。以 `async with` 開啟與關閉（建立連線池、寫入尚未同步到磁碟的檔案等），
+    store() 儲存一張圖片並回傳可放入 posts.json 的連結，失敗時回傳 None。
+    """
+
+    name = "storage"
+
+    def __init__(self, metrics=None):
+        self.metrics = metrics # 選用的 RunMetrics
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        pass
+
+    @abc.abstractmethod
+    async def store(self, data: bytes, file_name: str, mime_type: str) -> str | None:
+        """儲存一張圖片，回傳連結；失敗時回傳 None。"""
+
+    def _span(self, name: str):
+        return self.metrics.span(name) if self.metrics else nullcontext()
+
+    def _count(self, name: str, value: float = 1):
+        if self.metrics:
+            self.metrics.count(name, value)
+
+
+class UploadError(Exception):
+    def __init__(self, message: str, retryable: bool):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class ImgBBStorage(ImageStorage):
+    """
+    上傳到 ImgBB。整個執行共用一個 aiohttp session，連線池中的 keep-alive 連線會被重複使用，不必每張圖片重新做 TLS 握手。
+    網路錯誤、逾時與 429/5xx 回應以「完全隨機」的指數退避 (full jitter) 重試最多 max_retries 次，
+    避免多個上傳 worker 在同一時間一起重試；API 回報的其他錯誤不重試。
+    """
+
+    name = "imgbb"
+
+    def __init__(self, api_key: str, upload_url: str = IMGBB_UPLOAD_URL, pool_size: int = 3,
+                 max_retries: int = UPLOAD_MAX_RETRIES, backoff_base: float = UPLOAD_BACKOFF_BASE,
+                 backoff_max: float = UPLOAD_BACKOFF_MAX, timeout: float = 120, metrics=None):
+        super().__init__(metrics)
+        self.api_key = api_key
+        self.upload_url = upload_url
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.session = None
+
+    async def __aenter__(self):
+        import aiohttp
+
+        connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def backoff_seconds(self, attempt: int) -> float:
+        """第 attempt 次重試（從 0 開始）前等待的秒數：0 到 min(上限, base * 2^attempt) 之間的隨機值。"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def _upload_once(self, data: bytes, file_name: str, mime_type: str) -> str:
+        import aiohttp
+
+        form = aiohttp.FormData()
+        # file_name 是一個提示名稱，不會影響實際儲存
+        form.add_field("image", data, filename=file_name, content_type=mime_type)
+        try:
+            async with self.session.post(self.upload_url, params={"key": self.api_key}, data=form) as response:
+                if response.status >= 400:
+                    raise UploadError(f"HTTP {response.status} {response.reason}",
+                                      retryable=response.status in RETRYABLE_STATUS_CODES)
+                result = await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise UploadError(f"{type(e).__name__}: {e}", retryable=True) from e
+
+        if result and result.get("success"):
+            return result["data"]["url"]
+        error_message = (result or {}).get("error", {}).get("message", "未知錯誤")
+        raise UploadError(error_message, retryable=False)
+
+    async def store(self, data: bytes, file_name: str, mime_type: str) -> str | None:
+        print(f"正在上傳圖片 '{file_name}' 到 ImgBB...")
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self._span("imgbb_upload"):
+                    img_url = await self._upload_once(data, file_name, mime_type)
+            except UploadError as e:
+                if e.retryable and attempt < self.max_retries:
+                    delay = self.backoff_seconds(attempt)
+                    print(f"\nImgBB 上傳暫時失敗 ({file_name}): {e}，{delay:.1f} 秒後重試 ({attempt + 1}/{self.max_retries})...")
+                    self._count("upload_retries")
+                    await asyncio.sleep(delay)
+                    continue
+                print(f"\nImgBB 上傳失敗 ({file_name}): {e}")
+                self._count("upload_failures")
+                return None
+            except Exception as e:
+                print(f"\nImgBB 上傳過程中發生意外錯誤 ({file_name}): {e}")
+                self._count("upload_failures")
+                return None
+
+            print(f"圖片 '{file_name}' 上傳成功，URL: {img_url}")
+            self._count("images_uploaded")
+            self._count("bytes_uploaded", len(data))
+            return img_url
+        return None
+
+
+class LocalStorage(ImageStorage):
+    """
+    寫入本機目錄（預設為網站的 images/），由 GitHub Pages 或 server.js 直接提供，不經過第三方服務。
+    檔名為內容的 SHA-256 前 16 碼加副檔名，內容相同的圖片只會存一份，已存在時直接沿用。
+    每個檔案先寫入暫存檔再改名，不會出現寫了一半的圖片；fsync 則每 fsync_batch 個檔案與關閉時批次執行一次，
+    避免每張圖片都等待磁碟同步。
+    """
+
+    name = "local"
+
+    def __init__(self, directory: str = IMAGE_STORAGE_DIR, url_prefix: str | None = None,
+                 fsync_batch: int = LOCAL_FSYNC_BATCH, metrics=None):
+        super().__init__(metrics)
+        self.directory = directory
+        self.url_prefix = url_prefix if url_prefix is not None else directory.rstrip("/") + "/"
+        self.fsync_batch = max(1, fsync_batch)
+        self._unsynced = [] # 已寫入、改名但尚未 fsync 的檔案 (file descriptor)
+        self._lock = asyncio.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def content_file_name(data: bytes, file_name: str, mime_type: str) -> str:
+        extension = os.path.splitext(file_name)[1].lower()
+        if not extension:
+            extension = {"image/webp": ".webp", "image/png": ".png"}.get(mime_type, ".jpg")
+        return f"{hashlib.sha256(data).hexdigest()[:16]}{extension}"
+
+    def _write(self, path: str, data: bytes) -> bool:
+        if os.path.exists(path):
+            return False
+        temp_path = f"{path}.tmp"
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+            os.replace(temp_path, path)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._unsynced.append(fd) # 改名後檔案描述符仍指向同一個檔案，稍後批次 fsync
+        return True
+
+    def _sync(self):
+        """fsync 所有尚未同步的檔案，再 fsync 目錄一次，讓改名本身也寫入磁碟。"""
+        fds, self._unsynced = self._unsynced, []
+        for fd in fds:
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        if fds and hasattr(os, "O_DIRECTORY"):
+            dir_fd = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+    async def store(self, data: bytes, file_name: str, mime_type: str) -> str | None:
+        stored_name = self.content_file_name(data, file_name, mime_type)
+        path = os.path.join(self.directory, stored_name)
+        try:
+            # 同一時間只有一個寫入，避免兩個 worker 同時寫入相同內容的暫存檔
+            async with self._lock:
+                with self._span("local_write"):
+                    written = await asyncio.to_thread(self._write, path, data)
+                if len(self._unsynced) >= self.fsync_batch:
+                    await asyncio.to_thread(self._sync)
+        except OSError as e:
+            print(f"\n寫入圖片 '{file_name}' 到 {path} 失敗: {e}")
+            self._count("upload_failures")
+            return None
+
+        if written:
+            print(f"圖片 '{file_name}' 已儲存為 {path}")
+            self._count("images_uploaded")
+            self._count("bytes_uploaded", len(data))
+        else:
+            print(f"圖片 '{file_name}' 與已儲存的 {path} 內容相同，直接沿用。")
+        return self.url_prefix + stored_name
+
+    async def close(self):
+        async with self._lock:
+            await asyncio.to_thread(self._sync)
+
+
+def create_image_storage(kind: str = IMAGE_STORAGE, metrics=None, **kwargs) -> ImageStorage:
+    """依 IMAGE_STORAGE 建立儲存後端；kwargs 傳給對應的類別（例如 ImgBB 的 api_key、upload_url）。"""
+    if kind == "imgbb":
+        return ImgBBStorage(metrics=metrics, **kwargs)
+    if kind == "local":
+        return LocalStorage(metrics=metrics, **kwargs)
+    raise ValueError(f"未知的圖片儲存後端: {kind}（可用：imgbb、local）")
@@ -0,0 +1,59 @@
+# 圖片最佳化：把下載的原圖解碼一次，產生縮圖與中尺寸版本（在 process pool 中執行）
+import io
+import os
+
+# 各版本的最長邊像素；原圖本身會以原始位元組上傳，不重新編碼
+IMAGE_VARIANT_SIZES = {
+    "thumb": 320,
+    "medium": 960,
+}
+WEBP_QUALITY = int(os.getenv("WEBP_QUALITY", "80"))
+JPEG_QUALITY = int(os.getenv("JPEG_QUALITY", "85"))
+IMAGE_PROCESS_WORKERS = int(os.getenv("IMAGE_PROCESS_WORKERS", str(os.cpu_count() or 2)))
+
+
+def _encode_smallest(image, quality_webp: int, quality_jpeg: int) -> tuple[bytes, str, str]:
+    """同時編碼為 WebP 與 JPEG，回傳較小者的 (位元組, MIME 類型, 副檔名)。"""
+    webp_buffer = io.BytesIO()
+    image.save(webp_buffer, format="WEBP", quality=quality_webp, method=4)
+
+    jpeg_image = image.convert("RGB") if image.mode != "RGB" else image
+    jpeg_buffer = io.BytesIO()
+    jpeg_image.save(jpeg_buffer, format="JPEG", quality=quality_jpeg, optimize=True, progressive=True)
+
+    if webp_buffer.tell() <= jpeg_buffer.tell():
+        return webp_buffer.getvalue(), "image/webp", ".webp"
+    return jpeg_buffer.getvalue(), "image/jpeg", ".jpg"
+
+
+def build_image_variants(data: bytes) -> dict:
+    """
+    解碼原圖一次，依 IMAGE_VARIANT_SIZES 產生縮小版本，每個版本選用 WebP 或 JPEG 中較小的編碼。
+    原圖已經比某個尺寸小時，不會產生該版本（前端直接使用原圖即可）。
+    這是 CPU 密集的函式，應透過 ProcessPoolExecutor 執行，讓編碼與網路 I/O 重疊。
+    回傳 {"width", "height", "variants": {名稱: {"data", "mime_type", "ext", "width", "height"}}}。
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source) # 依 EXIF 方向轉正，避免縮圖方向錯誤
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGB")
+        width, height = image.size
+
+        variants = {}
+        for name, max_side in IMAGE_VARIANT_SIZES.items():
+            if max(width, height) <= max_side:
+                continue
+            resized = image.copy()
+            resized.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+            encoded, mime_type, ext = _encode_smallest(resized, WEBP_QUALITY, JPEG_QUALITY)
+            variants[name] = {
+                "data": encoded,
+                "mime_type": mime_type,
+                "ext": ext,
+                "width": resized.width,
+                "height": resized.height,
+            }
+
+    return {"width": width, "height": height, "variants": variants}
@@ -0,0 +1,161 @@
+# 執行期指標：各階段的計時區段 (span)、計數器與延遲直方圖，每次執行輸出為 JSON 檔
+import datetime
+import json
+import os
+import time
+from contextlib import contextmanager
+
+# 直方圖的區間上限（秒），最後一個區間收集所有更慢的值
+HISTOGRAM_BOUNDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class LatencyHistogram:
+    """固定區間的延遲直方圖，記憶體用量與觀測次數無關；百分位數以區間上限近似。"""
+
+    def __init__(self):
+        self.bucket_counts = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, seconds: float):
+        index = 0
+        while index < len(HISTOGRAM_BOUNDS) and seconds > HISTOGRAM_BOUNDS[index]:
+            index += 1
+        self.bucket_counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def percentile(self, fraction: float) -> float | None:
+        if not self.count:
+            return None
+        target = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.bucket_counts):
+            seen += bucket_count
+            if seen >= target:
+                return min(HISTOGRAM_BOUNDS[index], self.max) if index < len(HISTOGRAM_BOUNDS) else self.max
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.total, 6),
+            "min": round(self.min, 6) if self.min is not None else None,
+            "max": round(self.max, 6) if self.max is not None else None,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "buckets": {
+                (str(bound) if index < len(HISTOGRAM_BOUNDS) else "+Inf"): bucket_count
+                for index, (bound, bucket_count) in enumerate(zip(HISTOGRAM_BOUNDS + (None,), self.bucket_counts))
+            },
+        }
+
+
+class RunMetrics:
+    """
+    一次執行的指標。
+      - span(name)：計時區段，累計每個階段的次數與耗時，並把每次耗時記錄到同名的直方圖。
+        並行的 worker 會同時處於同一階段，因此各階段的耗時加總可能超過總耗時。
+      - count(name, value)：計數器，例如下載/上傳的位元組數、重試次數、FloodWait 秒數。
+      - observe(name, seconds)：直接記錄一筆延遲到直方圖。
+    """
+
+    def __init__(self):
+        self.start()
+
+    def start(self):
+        """重新開始計時並清空所有指標。"""
+        self.started_at = datetime.datetime.now()
+        self._started = time.monotonic()
+        self.stages = {}
+        self.counters = {}
+        self.histograms = {}
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self._started
+
+    @contextmanager
+    def span(self, name: str):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record_span(name, time.monotonic() - started)
+
+    def record_span(self, name: str, seconds: float):
+        stage = self.stages.setdefault(name, {"count": 0, "seconds": 0.0})
+        stage["count"] += 1
+        stage["seconds"] += seconds
+        self.observe(name, seconds)
+
+    def count(self, name: str, value: float = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float):
+        self.histograms.setdefault(name, LatencyHistogram()).observe(seconds)
+
+    def rate(self, counter: str, seconds: float | None = None) -> float | None:
+        """計數器每秒的平均速率（預設以執行至今的時間計算）。"""
+        seconds = self.elapsed if seconds is None else seconds
+        value = self.counters.get(counter, 0)
+        return value / seconds if value and seconds > 0 else None
+
+    def to_dict(self) -> dict:
+        duration = self.elapsed
+        return {
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "duration_seconds": round(duration, 3),
+            "stages": {
+                name: {"count": stage["count"], "seconds": round(stage["seconds"], 3)}
+                for name, stage in sorted(self.stages.items())
+            },
+            "counters": dict(sorted(self.counters.items())),
+            "rates": {
+                f"{name}_per_second": round(value / duration, 3)
+                for name, value in sorted(self.counters.items()) if duration > 0
+            },
+            "histograms": {name: histogram.to_dict() for name, histogram in sorted(self.histograms.items())},
+        }
+
+    def write(self, path: str):
+        # 先寫入暫存檔再替換，避免崩潰時留下寫了一半的檔案
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, path)
+
+    def summary_lines(self) -> list:
+        """供結束時印出的各階段耗時摘要，依耗時由多到少排列。"""
+        lines = []
+        for name, stage in sorted(self.stages.items(), key=lambda item: item[1]["seconds"], reverse=True):
+            histogram = self.histograms[name]
+            lines.append(f"  {name}: {stage['seconds']:.2f} 秒 / {stage['count']} 次"
+                         f" (p50≈{histogram.percentile(0.5):.3f} 秒, p90≈{histogram.percentile(0.9):.3f} 秒)")
+        return lines
+
+
+def load_previous_rate(path: str, counter: str) -> float | None:
+    """讀取上次執行的指標檔，回傳指定計數器的每秒速率，用於在開始前估算完成時間。"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get("rates", {}).get(f"{counter}_per_second") or None
+    except Exception:
+        return None
+
+
+def format_eta(remaining: float, rate: float | None) -> str:
+    """依實際測得的速率估算剩餘時間，速率未知時回傳空字串。"""
+    if not rate or remaining <= 0:
+        return ""
+    return f"，預計剩餘 {datetime.timedelta(seconds=round(remaining / rate))}"
@@ -0,0 +1,475 @@
+# 以 SQLite 保存所有貼文的索引式儲存，並由它重新產生 posts.json、月份分片與全文搜尋索引
+import json
+import os
+import re
+import sqlite3
+
+from posts_io import (POSTS_JSON_COMPACT, POSTS_SHARD_DIR, iter_json_posts, shard_key_for_post, update_post_shards,
+                      file_sha256, write_chunks_if_changed, write_posts_json)
+from search_index import (SEARCH_INDEX_BUCKETS, SEARCH_INDEX_DIR, term_bucket, text_ngrams,
+                          write_search_bucket, write_search_docs)
+
+POST_STORE_FILE = "posts.db"
+# 與 posts.json 放在同一目錄的附屬檔，每行一則 {"id", "photo_id", "edit_date"}：
+# 這兩個欄位不輸出到 posts.json，資料庫不提交到 Git，需要從 posts.json 重建資料庫時由這個檔案還原
+POST_META_FILE_NAME = "posts-meta.jsonl"
+
+SCHEMA_VERSION = 2 # 2：以訊息 ID 為唯一鍵、新增 edit_date 欄位
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS posts (
+    pk INTEGER PRIMARY KEY AUTOINCREMENT, -- 插入順序，用於穩定排序沒有訊息 ID 的舊貼文
+    id INTEGER,                           -- Telegram 訊息 ID，早期由 hispy.py 產生的貼文沒有此欄位
+    date TEXT NOT NULL,                   -- 台灣時區日期 YYYY-MM-DD
+    text_key TEXT NOT NULL,               -- 文本前 50 字，用於匹配沒有訊息 ID 的舊貼文
+    photo_id INTEGER,                     -- Telegram 圖片 ID，只存在資料庫中，不輸出到 JSON
+    edit_date TEXT,                       -- 訊息最後編輯時間 (ISO 8601)，只存在資料庫中，用於偵測編輯
+    data TEXT NOT NULL                    -- 完整的 post 字典 (JSON)
+);
+
+-- 全文搜尋的倒排索引：每個 (詞, 貼文) 一列，隨貼文 upsert 同步更新
+CREATE TABLE IF NOT EXISTS search_postings (
+    term TEXT NOT NULL,                   -- 雙字詞
+    pk INTEGER NOT NULL,                  -- 對應 posts.pk，即搜尋索引中的文件編號
+    bucket INTEGER NOT NULL,              -- 詞所屬的分桶，對應 search/NN.json
+    positions TEXT NOT NULL,              -- 詞在文本中的位置 (JSON 陣列)
+    PRIMARY KEY (term, pk)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS search_postings_pk ON search_postings (pk);
+CREATE INDEX IF NOT EXISTS search_postings_bucket ON search_postings (bucket, term);
+
+-- 資料庫本身的狀態，例如是否需要在下次輸出時完整重建
+CREATE TABLE IF NOT EXISTS store_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# 索引在結構遷移之後才建立：舊版資料庫的 (date, text_key) 是唯一索引，需要先移除
+INDEXES = """
+CREATE UNIQUE INDEX IF NOT EXISTS posts_message_id ON posts (id) WHERE id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS posts_date_text_key ON posts (date, text_key);
+CREATE INDEX IF NOT EXISTS posts_date_id ON posts (date, id);
+CREATE INDEX IF NOT EXISTS posts_photo_id ON posts (photo_id);
+"""
+
+# 圖片檔名以「日期_訊息ID_文本片段.jpg」命名（ImgBB 會把底線換成連字號），
+# 例如 images/2020-01-28_17.jpg、https://i.ibb.co/xxxx/2025-08-13-2132.jpg
+IMAGE_MESSAGE_ID_PATTERN = re.compile(r"(\d{4}-\d{2}-\d{2})[_-](\d+)(?=[_.-])")
+
+# 輸出順序：日期降序，同一天再依訊息 ID 降序，最後依插入順序保持穩定。
+# 仍有沒有 ID 的舊貼文的日期無法以 ID 排序，整天改依插入順序（即匯入時 posts.json 的原始順序）
+EXPORT_ORDER = """
+ORDER BY date DESC,
+    CASE WHEN date IN (SELECT date FROM posts WHERE id IS NULL) THEN 0 ELSE id END DESC,
+    pk ASC
+"""
+
+
+def post_meta_path(json_path: str) -> str:
+    return os.path.join(os.path.dirname(json_path), POST_META_FILE_NAME)
+
+
+def post_text_key(post: dict) -> str:
+    """取前 50 字作為文本鍵，用於匹配重複貼文"""
+    return (post.get("text") or "").strip()[:50]
+
+
+def message_id_from_image(post: dict) -> int | None:
+    """從貼文的圖片檔名取得訊息 ID；檔名中的日期必須與貼文日期相同，否則視為無法判斷。"""
+    file_name = (post.get("image") or "").rsplit("/", 1)[-1]
+    match = IMAGE_MESSAGE_ID_PATTERN.match(file_name)
+    if match and match.group(1) == post.get("date"):
+        return int(match.group(2))
+    return None
+
+
+class PostStore:
+    """
+    以 SQLite 保存所有貼文，並在訊息 ID、(date, id) 與圖片 ID 上建立索引。
+    每日執行只需查詢與 upsert 本次處理的貼文，不必把整個 posts.json 讀入記憶體再合併、排序。
+    資料庫不存在時，會從現有的 posts.json 匯入一次，並從 posts-meta.jsonl 還原圖片 ID 與編輯時間；
+    posts.json 與資料庫上次輸出的內容不同時（例如在每日排程之外修改或回退過），同樣從 posts.json 重建。
+    貼文以 Telegram 訊息 ID 為唯一鍵，編輯過的訊息會更新原本的貼文；沒有 ID 的舊貼文才以 (date, text_key) 匹配，
+    開啟時會嘗試從圖片檔名補上它們的訊息 ID。
+    同時維護全文搜尋的倒排索引：upsert 時只重新索引被改動的貼文，並記錄受影響的分桶。
+    """
+
+    def __init__(self, path: str = POST_STORE_FILE, bootstrap_json: str | None = "posts.json"):
+        self.path = path
+        is_new = not os.path.exists(path)
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+        self.dirty_search_buckets = set() # 自上次輸出後有改動的搜尋索引分桶
+        # 結構遷移或補上訊息 ID 會改變許多貼文與輸出順序，下次 export() 時完整重建所有輸出
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION and self._migrate_schema():
+            self.needs_full_export = True
+        if bootstrap_json and os.path.exists(bootstrap_json) and (
+                is_new or self.exported_json_sha256 != file_sha256(bootstrap_json)):
+            if not is_new:
+                print(f"警告：{bootstrap_json} 與貼文資料庫 {self.path} 上次輸出的內容不同，將以 {bootstrap_json} 為準重建資料庫。")
+                self._clear()
+            self.import_json(bootstrap_json)
+            self.import_meta(post_meta_path(bootstrap_json))
+            self.exported_json_sha256 = file_sha256(bootstrap_json)
+            # 重建的資料庫中 pk（搜尋索引的文件編號）不一定與現有的 search/ 相同，第一次輸出時完整重建
+            self.needs_full_export = True
+        elif self.count() and not self.conn.execute("SELECT 1 FROM search_postings LIMIT 1").fetchone():
+            # 舊版資料庫沒有搜尋索引，補建一次
+            self.rebuild_search_index()
+        if self.migrate_missing_ids():
+            self.needs_full_export = True
+
+    def _migrate_schema(self) -> bool:
+        """
+        升級舊版資料庫：(date, text_key) 改為一般索引、訊息 ID 改為唯一鍵並新增 edit_date 欄位。
+        舊版以 (date, text_key) 為鍵，編輯過文字的訊息會留下多筆相同 ID 的貼文，只保留最後寫入的一筆。
+        回傳是否升級了已有貼文的資料庫。
+        """
+        with self.conn:
+            columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(posts)")}
+            if "edit_date" not in columns:
+                self.conn.execute("ALTER TABLE posts ADD COLUMN edit_date TEXT")
+            self.conn.execute("DROP INDEX IF EXISTS posts_date_text_key")
+            self.conn.execute("DROP INDEX IF EXISTS posts_id")
+            stale = [row[0] for row in self.conn.execute(
+                """
+                SELECT pk FROM posts WHERE id IS NOT NULL
+                AND pk NOT IN (SELECT MAX(pk) FROM posts WHERE id IS NOT NULL GROUP BY id)
+                """
+            )]
+            for pk in stale:
+                self._unindex_post(pk)
+                self.conn.execute("DELETE FROM posts WHERE pk = ?", (pk,))
+            for statement in INDEXES.strip().splitlines():
+                self.conn.execute(statement)
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            if not self.count():
+                return False
+        print(f"已升級貼文資料庫 {self.path} 的結構（移除 {len(stale)} 筆重複的訊息 ID）。")
+        return True
+
+    def _get_meta(self, key: str) -> str | None:
+        row = self.conn.execute("SELECT value FROM store_meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: str):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO store_meta (key, value) VALUES (?, ?)", (key, value))
+
+    @property
+    def needs_full_export(self) -> bool:
+        """
+        下次 export() 是否必須完整重建所有輸出。記錄在資料庫中而不是物件上：
+        遷移後的那次執行若沒有寫入輸出檔，下次開啟時仍會完整重建，不會只更新部分月份。
+        """
+        return self._get_meta("needs_full_export") == "1"
+
+    @needs_full_export.setter
+    def needs_full_export(self, value: bool):
+        self._set_meta("needs_full_export", "1" if value else "0")
+
+    @property
+    def exported_json_sha256(self) -> str | None:
+        """資料庫上次輸出（或匯入）的 posts.json 內容雜湊，用於偵測 posts.json 是否在資料庫之外被修改。"""
+        return self._get_meta("posts_json_sha256")
+
+    @exported_json_sha256.setter
+    def exported_json_sha256(self, value: str):
+        self._set_meta("posts_json_sha256", value)
+
+    def _clear(self):
+        """清空所有貼文與搜尋索引，pk 從 1 重新編號，與新建立的資料庫相同。"""
+        with self.conn:
+            self.conn.execute("DELETE FROM search_postings")
+            self.conn.execute("DELETE FROM posts")
+            self.conn.execute("DELETE FROM sqlite_sequence WHERE name = 'posts'")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def import_json(self, json_path: str):
+        """從 posts.json（或每行一則貼文的 JSONL 檔）逐筆匯入所有貼文，不會把整個檔案載入記憶體。"""
+        print(f"正在從 {json_path} 建立貼文資料庫 {self.path} ...")
+        # 依檔案順序插入：同一天且沒有 ID 的貼文以插入順序 (pk) 排序，維持原本的相對順序
+        self.upsert_posts(iter_json_posts(json_path))
+        print(f"已匯入 {self.count()} 筆貼文。")
+
+    def import_meta(self, meta_path: str):
+        """從 posts-meta.jsonl 還原圖片 ID 與編輯時間；檔案不存在時略過。"""
+        if not os.path.exists(meta_path):
+            return
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE posts SET photo_id = ?, edit_date = ? WHERE id = ?",
+                ((record.get("photo_id"), record.get("edit_date"), record["id"]) for record in iter_json_posts(meta_path)),
+            )
+        print(f"已從 {meta_path} 還原圖片 ID 與編輯時間。")
+
+    def export_meta(self, meta_path: str) -> bool:
+        """輸出 posts-meta.jsonl（依訊息 ID 排序，內容沒有變更時不改動檔案）。回傳是否有寫入。"""
+        rows = self.conn.execute(
+            """
+            SELECT id, photo_id, edit_date FROM posts
+            WHERE id IS NOT NULL AND (photo_id IS NOT NULL OR edit_date IS NOT NULL) ORDER BY id
+            """
+        )
+        lines = (
+            json.dumps({key: row[key] for key in ("id", "photo_id", "edit_date") if row[key] is not None},
+                       separators=(",", ":")).encode("utf-8") + b"\n"
+            for row in rows
+        )
+        return write_chunks_if_changed(meta_path, lines)
+
+    def migrate_missing_ids(self) -> int:
+        """
+        為沒有訊息 ID 的舊貼文補上 ID：從圖片檔名取得（檔名含日期與訊息 ID），
+        已被其他貼文使用的 ID 不會重複指定。補上 ID 後，這些貼文也能被編輯與刪除的偵測涵蓋。
+        回傳補上 ID 的貼文數。
+        """
+        rows = self.conn.execute("SELECT pk, data FROM posts WHERE id IS NULL ORDER BY pk").fetchall()
+        migrated = 0
+        with self.conn:
+            for row in rows:
+                post = json.loads(row["data"])
+                msg_id = message_id_from_image(post)
+                if msg_id is None or self.conn.execute("SELECT 1 FROM posts WHERE id = ?", (msg_id,)).fetchone():
+                    continue
+                post.pop("id", None)
+                post = {"id": msg_id, **post}
+                self.conn.execute("UPDATE posts SET id = ?, data = ? WHERE pk = ?",
+                                  (msg_id, json.dumps(post, ensure_ascii=False), row["pk"]))
+                migrated += 1
+        if migrated:
+            print(f"已從圖片檔名為 {migrated} 筆舊貼文補上訊息 ID。")
+        return migrated
+
+    def count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM posts").fetchone()[0]
+
+    def max_message_id(self) -> int:
+        return self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM posts").fetchone()[0]
+
+    def get_by_key(self, date: str, text_key: str, without_id: bool = False) -> dict | None:
+        """以 (date, text_key) 查詢；without_id=True 時只匹配沒有訊息 ID 的舊貼文。"""
+        row = self.conn.execute(
+            f"SELECT data FROM posts WHERE date = ? AND text_key = ? {'AND id IS NULL' if without_id else ''} "
+            "ORDER BY pk LIMIT 1",
+            (date, text_key),
+        ).fetchone()
+        return json.loads(row["data"]) if row else None
+
+    def get_by_message_id(self, msg_id: int) -> dict | None:
+        row = self.conn.execute("SELECT data FROM posts WHERE id = ?", (msg_id,)).fetchone()
+        return json.loads(row["data"]) if row else None
+
+    def get_by_photo_id(self, photo_id: int) -> dict | None:
+        row = self.conn.execute(
+            "SELECT data FROM posts WHERE photo_id = ? AND json_extract(data, '$.image') IS NOT NULL LIMIT 1",
+            (photo_id,),
+        ).fetchone()
+        return json.loads(row["data"]) if row else None
+
+    def get_message_states(self, msg_ids) -> dict:
+        """回傳 {訊息 ID: {"post", "photo_id", "edit_date"}}，用於判斷訊息在 Telegram 上是否被編輯過。"""
+        states = {}
+        msg_ids = list(msg_ids)
+        for start in range(0, len(msg_ids), 500): # SQLite 的參數數量有上限
+            chunk = msg_ids[start:start + 500]
+            for row in self.conn.execute(
+                f"SELECT id, photo_id, edit_date, data FROM posts WHERE id IN ({','.join('?' * len(chunk))})", chunk
+            ):
+                states[row["id"]] = {"post": json.loads(row["data"]), "photo_id": row["photo_id"],
+                                     "edit_date": row["edit_date"]}
+        return states
+
+    def message_ids(self, since_date: str | None = None, before_id: int | None = None,
+                    limit: int | None = None, min_id: int | None = None) -> list:
+        """由新到舊列出已保存的訊息 ID，可限定日期 (YYYY-MM-DD) 之後、某個 ID 之前、某個 ID（含）之後與數量。"""
+        conditions = ["id IS NOT NULL"]
+        params = []
+        if min_id is not None:
+            conditions.append("id >= ?")
+            params.append(min_id)
+        if since_date is not None:
+            conditions.append("date >= ?")
+            params.append(since_date)
+        if before_id is not None:
+            conditions.append("id < ?")
+            params.append(before_id)
+        sql = f"SELECT id FROM posts WHERE {' AND '.join(conditions)} ORDER BY id DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [row[0] for row in self.conn.execute(sql, params)]
+
+    def upsert_posts(self, posts, photo_ids: dict | None = None, edit_dates: dict | None = None) -> set:
+        """
+        依序新增或更新貼文，整批在同一個交易中完成。
+        有訊息 ID 的貼文以 ID 為鍵，編輯過文字的訊息會更新原本的貼文而不是新增一筆；
+        第一次寫入時若有相同 (date, text_key) 但沒有 ID 的舊貼文，會接手該筆貼文並補上 ID。
+        沒有 ID 的貼文（例如從舊的 posts.json 匯入）以 (date, text_key) 匹配，並保留已知的訊息 ID。
+        photo_ids / edit_dates 為 {訊息 ID: Telegram 圖片 ID / 編輯時間}。回傳被改動的月份 (YYYY-MM) 集合。
+        """
+        photo_ids = photo_ids or {}
+        edit_dates = edit_dates or {}
+        touched_months = set()
+        with self.conn:
+            for post in posts:
+                date = post.get("date")
+                if not date:
+                    continue
+                msg_id = post.get("id")
+                text_key = post_text_key(post)
+                row = None
+                if msg_id is not None:
+                    row = self.conn.execute("SELECT pk, id, date FROM posts WHERE id = ?", (msg_id,)).fetchone()
+                if row is None:
+                    row = self.conn.execute(
+                        f"SELECT pk, id, date FROM posts WHERE date = ? AND text_key = ? "
+                        f"{'AND id IS NULL' if msg_id is not None else ''} ORDER BY id IS NOT NULL, pk LIMIT 1",
+                        (date, text_key),
+                    ).fetchone()
+                if msg_id is None and row is not None and row["id"] is not None:
+                    msg_id = row["id"]
+                    post = {"id": msg_id, **post}
+
+                values = (msg_id, date, text_key, photo_ids.get(msg_id), edit_dates.get(msg_id),
+                          json.dumps(post, ensure_ascii=False))
+                if row is None:
+                    pk = self.conn.execute(
+                        "INSERT INTO posts (id, date, text_key, photo_id, edit_date, data) VALUES (?, ?, ?, ?, ?, ?)",
+                        values,
+                    ).lastrowid
+                else:
+                    pk = row["pk"]
+                    self.conn.execute(
+                        """
+                        UPDATE posts SET id = ?, date = ?, text_key = ?, photo_id = COALESCE(?, photo_id),
+                            edit_date = COALESCE(?, edit_date), data = ?
+                        WHERE pk = ?
+                        """,
+                        (*values, pk),
+                    )
+                    touched_months.add(row["date"][:7]) # 編輯可能改變日期，原本的月份也需要重新產生
+                self._index_post(pk, post.get("text"))
+                touched_months.add(shard_key_for_post(post))
+        return touched_months
+
+    def update_message_meta(self, photo_ids: dict | None = None, edit_dates: dict | None = None):
+        """只更新資料庫中的圖片 ID 與編輯時間，不改變貼文內容與輸出檔。"""
+        photo_ids = photo_ids or {}
+        edit_dates = edit_dates or {}
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE posts SET photo_id = COALESCE(?, photo_id), edit_date = COALESCE(?, edit_date) WHERE id = ?",
+                [(photo_ids.get(msg_id), edit_dates.get(msg_id), msg_id) for msg_id in set(photo_ids) | set(edit_dates)],
+            )
+
+    def delete_by_message_ids(self, msg_ids) -> set:
+        """刪除已在 Telegram 上被刪除的訊息，並從搜尋索引移除。回傳被改動的月份集合。"""
+        touched_months = set()
+        with self.conn:
+            for msg_id in msg_ids:
+                row = self.conn.execute("SELECT pk, date FROM posts WHERE id = ?", (msg_id,)).fetchone()
+                if row is None:
+                    continue
+                self._unindex_post(row["pk"])
+                self.conn.execute("DELETE FROM posts WHERE pk = ?", (row["pk"],))
+                touched_months.add(row["date"][:7])
+        return touched_months
+
+    def _unindex_post(self, pk: int):
+        """從倒排索引移除貼文的所有詞，並把這些詞所在的分桶標記為需要重新輸出。"""
+        old_terms = [row[0] for row in self.conn.execute("SELECT term FROM search_postings WHERE pk = ?", (pk,))]
+        self.conn.execute("DELETE FROM search_postings WHERE pk = ?", (pk,))
+        self.dirty_search_buckets.update(term_bucket(term) for term in old_terms)
+
+    def _index_post(self, pk: int, text: str | None):
+        """以貼文目前的文本重建它在倒排索引中的所有詞，舊詞與新詞所在的分桶都標記為需要重新輸出。"""
+        self._unindex_post(pk)
+        ngrams = text_ngrams(text)
+        self.conn.executemany(
+            "INSERT INTO search_postings (term, pk, bucket, positions) VALUES (?, ?, ?, ?)",
+            [(term, pk, term_bucket(term), json.dumps(positions)) for term, positions in ngrams.items()],
+        )
+        self.dirty_search_buckets.update(term_bucket(term) for term in ngrams)
+
+    def rebuild_search_index(self):
+        """從所有貼文重建倒排索引。"""
+        print(f"正在為 {self.count()} 筆貼文建立全文搜尋索引...")
+        with self.conn:
+            self.conn.execute("DELETE FROM search_postings")
+            rows = self.conn.execute("SELECT pk, data FROM posts").fetchall()
+            for row in rows:
+                self._index_post(row["pk"], json.loads(row["data"]).get("text"))
+        self.dirty_search_buckets = set(range(SEARCH_INDEX_BUCKETS))
+        self.needs_full_export = True
+
+    def iter_posts(self, where: str = "", params: tuple = ()):
+        """依輸出順序逐筆產生貼文字典，不會一次把所有資料載入記憶體。"""
+        cursor = self.conn.execute(f"SELECT data FROM posts {where} {EXPORT_ORDER}", params)
+        for row in cursor:
+            yield json.loads(row["data"])
+
+    def posts_in_month(self, month: str) -> list:
+        # 日期是 YYYY-MM-DD 字串，以字串範圍查詢可以使用 (date, id) 索引
+        return list(self.iter_posts("WHERE date >= ? AND date <= ?", (f"{month}-00", f"{month}-99")))
+
+    def export_json(self, json_path: str, compact: bool = POSTS_JSON_COMPACT):
+        """從資料庫逐筆串流重新產生 posts.json（新到舊排列）及其預先壓縮檔與版本檔，記憶體用量與貼文數無關。"""
+        version = write_posts_json(json_path, self.iter_posts(), compact=compact)
+        self.exported_json_sha256 = version["sha256"]
+        return version
+
+    def export(self, json_path: str, months: set | None = None, shard_dir: str = POSTS_SHARD_DIR,
+               index_dir: str = SEARCH_INDEX_DIR, compact: bool = POSTS_JSON_COMPACT):
+        """
+        重新產生 posts.json、posts-meta.jsonl 與月份分片。指定 months 時只重新產生那些月份的分片，
+        其他月份的分片與清單記錄保持不變；資料庫剛完成遷移或重建時一律完整重建。
+        """
+        self.export_json(json_path, compact=compact)
+        self.export_meta(post_meta_path(json_path))
+        full_rebuild = months is None or self.needs_full_export
+        if full_rebuild:
+            months = {row[0] for row in self.conn.execute("SELECT DISTINCT substr(date, 1, 7) FROM posts")}
+        # 分片逐月查詢與輸出，一次只有一個月份的貼文在記憶體中
+        update_post_shards(((month, self.posts_in_month(month)) for month in sorted(months)),
+                           total=self.count(), shard_dir=shard_dir, prune=full_rebuild, compact=compact)
+        self.export_search_index(index_dir, full_rebuild=full_rebuild)
+        if full_rebuild and self.needs_full_export:
+            self.needs_full_export = False # 完整重建成功後才清除
+
+    def export_search_index(self, index_dir: str = SEARCH_INDEX_DIR, full_rebuild: bool = False):
+        """
+        輸出搜尋索引：文件表 docs.json 每次重新產生（只含日期與順序，很小），
+        倒排索引分桶只重新產生自上次輸出後有改動的分桶；full_rebuild 時重新產生全部分桶。
+        """
+        # 文件表：依 posts.json 的順序，計算每則貼文是當天的第幾則
+        docs = {}
+        date_counts = {}
+        for row in self.conn.execute(f"SELECT pk, date, id FROM posts {EXPORT_ORDER}"):
+            ordinal = date_counts.get(row["date"], 0)
+            date_counts[row["date"]] = ordinal + 1
+            docs[str(row["pk"])] = [row["date"], ordinal] + ([row["id"]] if row["id"] is not None else [])
+        write_search_docs(docs, index_dir)
+
+        buckets = range(SEARCH_INDEX_BUCKETS) if full_rebuild else sorted(self.dirty_search_buckets)
+        changed_buckets = []
+        for bucket in buckets:
+            postings = {}
+            for row in self.conn.execute(
+                "SELECT term, pk, positions FROM search_postings WHERE bucket = ? ORDER BY term, pk", (bucket,)
+            ):
+                postings.setdefault(row["term"], []).append([row["pk"], *json.loads(row["positions"])])
+            if write_search_bucket(bucket, postings, index_dir):
+                changed_buckets.append(bucket)
+        self.dirty_search_buckets = set()
+        print(f"已更新 {len(changed_buckets)} 個搜尋索引分桶，共 {len(docs)} 則貼文。")
@@ -0,0 +1,314 @@
+# posts.json 的讀寫工具：逐筆串流讀寫、依月份切分的分片檔、記錄各分片雜湊的清單 (manifest)、預先壓縮檔與版本檔
+import datetime
+import hashlib
+import json
+import os
+import zlib
+
+try:
+    import brotli # 選用套件：沒有安裝時只輸出 .gz
+except ImportError:
+    brotli = None
+
+POSTS_SHARD_DIR = "posts" # 分片輸出目錄，例如 posts/2025-08.json
+MANIFEST_FILE_NAME = "manifest.json" # 分片清單，例如 posts/manifest.json
+POSTS_VERSION_FILE_NAME = "posts-version.json" # 與 posts.json 放在同一目錄的版本檔
+# 設為 1 時 posts.json 與分片改為每則貼文一行、不含縮排的緊湊格式（仍是合法的 JSON 陣列）；預設為 indent=2
+POSTS_JSON_COMPACT = os.getenv("POSTS_JSON_COMPACT", "0") == "1"
+STREAM_CHUNK_SIZE = 1 << 16 # 串流讀取與壓縮時每次處理的位元組數
+
+
+def shard_key_for_post(post: dict) -> str:
+    """以貼文日期的年月 (YYYY-MM) 作為分片鍵。"""
+    return (post.get("date") or "unknown")[:7]
+
+
+def iter_serialized_posts(posts, compact: bool = POSTS_JSON_COMPACT):
+    """
+    逐筆產生 JSON 陣列的內容 (bytes)，不必先把所有貼文組成列表再一次序列化。
+    預設格式與 json.dumps(posts, ensure_ascii=False, indent=2) 的輸出完全相同；
+    compact=True 時每則貼文一行、不含縮排與多餘空白，仍方便逐行 diff。
+    """
+    first = True
+    for post in posts:
+        if compact:
+            body = json.dumps(post, ensure_ascii=False, separators=(",", ":"))
+        else:
+            # 陣列元素多一層縮排；字串中的換行已被跳脫，內容中的 "\n" 都是排版用的換行
+            body = "  " + json.dumps(post, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+        yield (("[\n" if first else ",\n") + body).encode("utf-8")
+        first = False
+    yield b"[]" if first else b"\n]"
+
+
+def serialize_posts(posts, compact: bool = POSTS_JSON_COMPACT) -> bytes:
+    # 與 posts.json 相同的格式：ensure_ascii=False 保留中文
+    return b"".join(iter_serialized_posts(posts, compact))
+
+
+def iter_json_posts(path: str, chunk_size: int = STREAM_CHUNK_SIZE):
+    """
+    逐筆讀取 JSON 陣列（posts.json）或 JSONL（每行一則貼文）檔案中的貼文。
+    每次只讀入 chunk_size 的內容並以 raw_decode 解析出完整的物件，記憶體用量取決於單則貼文的大小，
+    與檔案大小無關。
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8-sig") as f:
+        buffer = f.read(chunk_size)
+        pos = 0
+        eof = not buffer
+        in_array = None
+        while True:
+            # 略過空白與元素之間的逗號，必要時讀入下一段
+            while True:
+                while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    break
+                buffer, pos = f.read(chunk_size), 0
+                eof = not buffer
+            if pos >= len(buffer):
+                return
+            if in_array is None:
+                # 第一個字元是 "[" 時為 JSON 陣列，否則視為 JSONL
+                in_array = buffer[pos] == "["
+                if in_array:
+                    pos += 1
+                    continue
+            if in_array and buffer[pos] == "]":
+                return
+            try:
+                post, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # 物件跨越了這一段的結尾：保留未解析的部分並讀入下一段
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer, pos = buffer[pos:] + chunk, 0
+                continue
+            yield post
+
+
+def atomic_write_bytes(path: str, content: bytes):
+    """先寫入同目錄的暫存檔再以 os.replace 替換，讀取端（網頁伺服器、Git）不會看到寫了一半的檔案。"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def write_chunks(path: str, chunks) -> str:
+    """逐段寫入可迭代的 bytes 片段並 fsync，回傳內容的 SHA-256。"""
+    digest = hashlib.sha256()
+    with open(path, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+            digest.update(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    return digest.hexdigest()
+
+
+def atomic_write_chunks(path: str, chunks) -> str:
+    """與 atomic_write_bytes 相同，但內容以 bytes 片段逐段寫入，不必先在記憶體中組成完整內容。回傳內容的 SHA-256。"""
+    temp_path = f"{path}.tmp"
+    content_hash = write_chunks(temp_path, chunks)
+    os.replace(temp_path, path)
+    return content_hash
+
+
+def file_sha256(path: str) -> str | None:
+    """計算檔案內容的 SHA-256；檔案不存在時回傳 None。"""
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    for chunk in iter_file_chunks(path):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_chunks_if_changed(path: str, chunks) -> bool:
+    """逐段寫入暫存檔並計算雜湊；內容與現有檔案相同時捨棄暫存檔，不改動原檔。回傳是否有寫入。"""
+    temp_path = f"{path}.tmp"
+    content_hash = write_chunks(temp_path, chunks)
+    if file_sha256(path) == content_hash:
+        os.remove(temp_path)
+        return False
+    os.replace(temp_path, path)
+    return True
+
+
+def iter_file_chunks(path: str, chunk_size: int = STREAM_CHUNK_SIZE):
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+def iter_gzip_chunks(chunks):
+    # wbits=31 由 zlib 產生 gzip 標頭（mtime 為 0）與結尾，輸出與 gzip.compress(content, compresslevel=9, mtime=0) 相同
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        if data := compressor.compress(chunk):
+            yield data
+    yield compressor.flush()
+
+
+def iter_brotli_chunks(chunks):
+    compressor = brotli.Compressor(quality=11)
+    for chunk in chunks:
+        if data := compressor.process(chunk):
+            yield data
+    yield compressor.finish()
+
+
+def write_precompressed(path: str) -> list:
+    """
+    由已寫入的 path 逐段產生預先壓縮的 path.gz 與 path.br（有安裝 brotli 時），讓伺服器直接回傳壓縮檔，
+    不必每次請求都重新壓縮；壓縮時不會把整個檔案讀入記憶體。
+    gzip 的 mtime 固定為 0，內容相同時壓縮檔也完全相同。壓縮檔不提交到 Git（見 .gitignore），每次需要時重新產生。
+    回傳寫入的檔案路徑。
+    """
+    written = [f"{path}.gz"]
+    atomic_write_chunks(written[0], iter_gzip_chunks(iter_file_chunks(path)))
+    if brotli is not None:
+        written.append(f"{path}.br")
+        atomic_write_chunks(written[1], iter_brotli_chunks(iter_file_chunks(path)))
+    return written
+
+
+def posts_version_path(json_path: str) -> str:
+    return os.path.join(os.path.dirname(json_path), POSTS_VERSION_FILE_NAME)
+
+
+def load_posts_version(json_path: str) -> dict:
+    version_path = posts_version_path(json_path)
+    if not os.path.exists(version_path):
+        return {}
+    try:
+        with open(version_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def write_posts_json(json_path: str, posts, compact: bool = POSTS_JSON_COMPACT) -> dict:
+    """
+    寫入 posts.json、預先壓縮的 .gz/.br，以及約 100 bytes 的版本檔 {"sha256", "count", "newest_id", "updated_at"}。
+    posts 可以是任何可迭代的貼文（例如資料庫游標），邊序列化邊寫入暫存檔並計算雜湊，記憶體中一次只有一則貼文。
+    前端與 Service Worker 只需下載版本檔比對雜湊，內容有變更時才下載完整的 posts.json。
+    內容雜湊與上次相同時捨棄暫存檔，不改動 posts.json 與版本檔，只補上缺少的壓縮檔（壓縮檔不提交到 Git，簽出後不存在）。
+    版本檔最後寫入，讀到新版本時對應的 posts.json 必定已經就緒。
+    回傳版本檔內容。
+    """
+    stats = {"count": 0, "newest_id": None}
+
+    def counted(posts):
+        for post in posts:
+            stats["count"] += 1
+            if post.get("id") is not None and (stats["newest_id"] is None or post["id"] > stats["newest_id"]):
+                stats["newest_id"] = post["id"]
+            yield post
+
+    old_version = load_posts_version(json_path)
+    compressed_outputs = [f"{json_path}.gz"] + ([f"{json_path}.br"] if brotli is not None else [])
+    temp_path = f"{json_path}.tmp"
+    content_hash = write_chunks(temp_path, iter_serialized_posts(counted(posts), compact))
+    if old_version.get("sha256") == content_hash and os.path.exists(json_path):
+        os.remove(temp_path)
+        print(f"{json_path} 內容沒有變更，保留現有檔案。")
+        if not all(os.path.exists(path) for path in compressed_outputs):
+            write_precompressed(json_path)
+        return old_version
+
+    os.replace(temp_path, json_path)
+    write_precompressed(json_path)
+    version = {
+        "sha256": content_hash,
+        "count": stats["count"],
+        "newest_id": stats["newest_id"],
+        "updated_at": datetime.datetime.now().isoformat(timespec="seconds"),
+    }
+    atomic_write_bytes(posts_version_path(json_path),
+                       json.dumps(version, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+    return version
+
+
+def load_manifest(shard_dir: str = POSTS_SHARD_DIR) -> dict:
+    manifest_path = os.path.join(shard_dir, MANIFEST_FILE_NAME)
+    if not os.path.exists(manifest_path):
+        return {"shards": []}
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"警告：讀取 {manifest_path} 失敗: {e}。將重新產生所有分片。")
+        return {"shards": []}
+
+
+def update_post_shards(posts_by_month, total: int, shard_dir: str = POSTS_SHARD_DIR, prune: bool = False,
+                       compact: bool = POSTS_JSON_COMPACT) -> dict:
+    """
+    重新產生 posts_by_month 中列出的月份分片，並更新清單。posts_by_month 是 (月份, 該月已排序的貼文) 的序列，
+    可以是產生器，一次只需載入一個月份的貼文；空列表代表移除該分片。
+    清單清單記錄每個分片的內容雜湊與貼文數，只有雜湊改變的分片才會被重寫，
+    因此每日執行通常只會改動最新月份的分片與清單。
+    prune=True 時，posts_by_month 中沒有列出的月份分片也會被移除（用於完整重建）。
+    回傳新的清單內容。
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+
+    old_manifest = load_manifest(shard_dir)
+    old_shards = {shard["month"]: shard for shard in old_manifest.get("shards", [])}
+    shards = {} if prune else dict(old_shards)
+
+    changed_shards = []
+    removed_shards = []
+    for month, shard_posts in posts_by_month:
+        file_name = f"{month}.json"
+        file_path = os.path.join(shard_dir, file_name)
+
+        if not shard_posts:
+            shards.pop(month, None)
+            continue
+
+        content = serialize_posts(shard_posts, compact)
+        content_hash = hashlib.sha256(content).hexdigest()
+        old_shard = old_shards.get(month)
+        if not old_shard or old_shard.get("sha256") != content_hash or not os.path.exists(file_path):
+            atomic_write_bytes(file_path, content)
+            changed_shards.append(month)
+
+        shards[month] = {
+            "month": month,
+            "file": file_name,
+            "count": len(shard_posts),
+            "sha256": content_hash,
+        }
+
+    # 移除已經不再有貼文的分片
+    for month, old_shard in old_shards.items():
+        if month in shards:
+            continue
+        removed_shards.append(month)
+        file_path = os.path.join(shard_dir, old_shard.get("file", f"{month}.json"))
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+    if not changed_shards and not removed_shards and old_manifest.get("total") == total:
+        print(f"分片內容沒有變更，保留現有的 {shard_dir}/{MANIFEST_FILE_NAME}。")
+        return old_manifest
+
+    manifest = {
+        "updated_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "total": total,
+        "shards": [shards[month] for month in sorted(shards, reverse=True)], # 新的月份在前
+    }
+    atomic_write_bytes(os.path.join(shard_dir, MANIFEST_FILE_NAME),
+                       json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8"))
+
+    print(f"已更新 {len(changed_shards)} 個分片 ({', '.join(sorted(changed_shards, reverse=True)) or '無'})，"
+          f"移除 {len(removed_shards)} 個分片，共 {len(shards)} 個分片。")
+    return manifest
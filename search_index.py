@@ -0,0 +1,73 @@
+# 全文搜尋索引：以中文雙字 (bigram) 建立倒排索引，依詞的雜湊分成固定數量的分桶檔
+import json
+import os
+import unicodedata
+
+from posts_io import atomic_write_bytes
+
+SEARCH_INDEX_DIR = "search" # 索引輸出目錄，例如 search/docs.json、search/07.json
+SEARCH_DOCS_FILE_NAME = "docs.json" # 文件表：文件編號 -> 貼文位置
+SEARCH_INDEX_BUCKETS = 64 # 分桶數量；修改後需完整重建索引，前端的分桶計算也要一併修改
+NGRAM_SIZE = 2
+
+
+def is_indexable_char(ch: str) -> bool:
+    """只索引文字與數字（包含中日韓文字），標點、空白與表情符號不建立詞。"""
+    return unicodedata.category(ch)[0] in ("L", "N")
+
+
+def text_ngrams(text: str) -> dict:
+    """
+    將文本轉為小寫後，取出所有相鄰兩個可索引字元組成的詞。
+    回傳 {詞: [在文本中的字元位置, ...]}，位置用於前端判斷多個詞是否連續出現（片語比對）。
+    """
+    chars = (text or "").lower()
+    ngrams = {}
+    for i in range(len(chars) - NGRAM_SIZE + 1):
+        term = chars[i:i + NGRAM_SIZE]
+        if all(is_indexable_char(ch) for ch in term):
+            ngrams.setdefault(term, []).append(i)
+    return ngrams
+
+
+def term_bucket(term: str) -> int:
+    """詞所屬的分桶。前端 index.html 以相同的算法計算，只下載查詢用到的分桶。"""
+    h = 0
+    for ch in term:
+        h = (h * 31 + ord(ch)) % SEARCH_INDEX_BUCKETS
+    return h
+
+
+def bucket_file_name(bucket: int) -> str:
+    return f"{bucket:02d}.json"
+
+
+def _write_if_changed(path: str, content: bytes) -> bool:
+    """內容沒有改變時不重寫檔案，讓 Git 只記錄真正改動的分桶。"""
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            if f.read() == content:
+                return False
+    atomic_write_bytes(path, content)
+    return True
+
+
+def _serialize(data) -> bytes:
+    # 索引只給程式讀取，使用緊湊格式以減少下載大小
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def write_search_docs(docs: dict, index_dir: str = SEARCH_INDEX_DIR) -> bool:
+    """
+    寫入文件表 docs.json：{"ngram", "buckets", "docs": {文件編號: [日期, 當天第幾則, 訊息 ID?]}}。
+    早期貼文沒有訊息 ID，因此以「日期 + 在 posts.json 中當天的順序」定位貼文。
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    content = _serialize({"ngram": NGRAM_SIZE, "buckets": SEARCH_INDEX_BUCKETS, "docs": docs})
+    return _write_if_changed(os.path.join(index_dir, SEARCH_DOCS_FILE_NAME), content)
+
+
+def write_search_bucket(bucket: int, postings: dict, index_dir: str = SEARCH_INDEX_DIR) -> bool:
+    """寫入一個分桶：{詞: [[文件編號, 位置, 位置, ...], ...]}。回傳檔案是否有改變。"""
+    os.makedirs(index_dir, exist_ok=True)
+    return _write_if_changed(os.path.join(index_dir, bucket_file_name(bucket)), _serialize(postings))
@@ -6,6 +6,8 @@ const webpush = require('web-push');
 const bodyParser = require('body-parser');
 const path = require('path');
 const fs = require('fs');
+const zlib = require('zlib');
+const { pipeline } = require('stream');
 const cors = require('cors'); // 引入 cors 套件
 
 const app = express();
@@ -17,6 +19,58 @@ app.use(cors());
 // 使用 body-parser 中介軟體
 app.use(bodyParser.json());
 
+// 預先壓縮的 posts.json：依瀏覽器的 Accept-Encoding 直接回傳 posts.json.br 或 posts.json.gz，不必在每次請求時重新壓縮。
+// 壓縮檔不提交到 Git（見 .gitignore），伺服器啟動時由 posts.json 產生；已存在且不比 posts.json 舊的壓縮檔直接沿用
+const PRECOMPRESSED_FILES = ['/posts.json'];
+const PRECOMPRESSED_ENCODINGS = [['br', '.br'], ['gzip', '.gz']];
+const COMPRESSORS = {
+  '.br': () => zlib.createBrotliCompress({ params: { [zlib.constants.BROTLI_PARAM_QUALITY]: 11 } }),
+  '.gz': () => zlib.createGzip({ level: 9 }),
+};
+
+// 壓縮檔存在且不比原檔舊時才使用，避免回傳過期的內容
+function isFreshCompressed(sourcePath, compressedPath) {
+  return fs.existsSync(sourcePath) && fs.existsSync(compressedPath)
+    && fs.statSync(compressedPath).mtimeMs >= fs.statSync(sourcePath).mtimeMs;
+}
+
+function precompress(file) {
+  const sourcePath = path.join(__dirname, file);
+  if (!fs.existsSync(sourcePath)) return;
+  for (const [, extension] of PRECOMPRESSED_ENCODINGS) {
+    const compressedPath = sourcePath + extension;
+    if (isFreshCompressed(sourcePath, compressedPath)) continue;
+    // 先寫入暫存檔再改名：壓縮完成前的請求仍回傳未壓縮的檔案
+    const tempPath = `${compressedPath}.tmp`;
+    pipeline(fs.createReadStream(sourcePath), COMPRESSORS[extension](), fs.createWriteStream(tempPath), (err) => {
+      if (err) {
+        console.error(`產生 ${compressedPath} 失敗:`, err);
+        return;
+      }
+      fs.renameSync(tempPath, compressedPath);
+      console.log(`已產生 ${compressedPath}`);
+    });
+  }
+}
+PRECOMPRESSED_FILES.forEach(precompress);
+
+app.get(PRECOMPRESSED_FILES, (req, res, next) => {
+  const acceptEncoding = req.headers['accept-encoding'] || '';
+  for (const [encoding, extension] of PRECOMPRESSED_ENCODINGS) {
+    const sourcePath = path.join(__dirname, req.path);
+    const compressedPath = sourcePath + extension;
+    if (acceptEncoding.includes(encoding) && isFreshCompressed(sourcePath, compressedPath)) {
+      res.set({
+        'Content-Type': 'application/json; charset=utf-8',
+        'Content-Encoding': encoding,
+        'Vary': 'Accept-Encoding',
+      });
+      return res.sendFile(compressedPath);
+    }
+  }
+  next();
+});
+
 // 靜態檔案服務，讓前端檔案可以被存取
 app.use(express.static(path.join(__dirname, '.')));
 
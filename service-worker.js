@@ -262,12 +262,40 @@ self.addEventListener('periodicsync', event => {
   }
 });
 
+// 計算內容的 SHA-256（十六進位），與 everypy.py 輸出的版本檔雜湊比對
+async function sha256Hex(buffer) {
+  const digest = await crypto.subtle.digest('SHA-256', buffer);
+  return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+}
+
 async function checkForUpdatesAndNotify() {
   try {
     console.log('[Service Worker] 背景同步：正在檢查 posts.json 更新...');
     const cache = await caches.open(CACHE_NAME);
     // 構建正確的 posts.json URL，無論 PWA 部署在根目錄還是子路徑
     const postsJsonFullPath = new URL(`${PWA_SUB_PATH}/posts.json`, self.location.origin).href;
+    const versionFullPath = new URL(`${PWA_SUB_PATH}/posts-version.json`, self.location.origin).href;
+
+    // 獲取當前緩存中的 posts.json
+    const cachedResponse = await cache.match(postsJsonFullPath);
+
+    // 先下載約 100 bytes 的版本檔，與快取中 posts.json 的雜湊比對，內容相同時不必下載完整的 posts.json
+    if (cachedResponse) {
+      try {
+        const versionResponse = await fetch(versionFullPath, { cache: 'no-store' });
+        if (versionResponse.ok) {
+          const version = await versionResponse.json();
+          const cachedHash = await sha256Hex(await cachedResponse.clone().arrayBuffer());
+          if (version.sha256 === cachedHash) {
+            console.log('[Service Worker] 背景同步：內容無更新。');
+            return;
+          }
+        }
+      } catch (error) {
+        // 版本檔不存在或格式錯誤時，改為下載完整的 posts.json 比對
+        console.warn('[Service Worker] 無法讀取版本檔，改為比對完整的 posts.json。', error);
+      }
+    }
 
     // 總是嘗試從網路獲取最新 posts.json
     const networkResponse = await fetch(postsJsonFullPath, { cache: 'no-store' }); // 確保獲取最新
@@ -276,9 +304,6 @@ async function checkForUpdatesAndNotify() {
       return;
     }
 
-    // 獲取當前緩存中的 posts.json
-    const cachedResponse = await cache.match(postsJsonFullPath);
-
     if (cachedResponse) {
       const networkText = await networkResponse.clone().text();
       const cachedText = await cachedResponse.text();
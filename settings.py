@@ -0,0 +1,72 @@
+# 執行環境：載入 .env、檢查必要的環境變數、還原 Telethon session 與建立客戶端
+# 匯入本模組不會讀取檔案或連線；everypy.py、hispy.py 與 cli.py 只在真正需要時才呼叫這些函式，
+# telethon 與 python-dotenv 也只在第一次使用時才匯入。
+import base64
+import os
+
+SESSION_NAME = "anon" # Telethon session 檔案名 (anon.session)
+
+_env_loaded = False
+
+
+class ConfigError(Exception):
+    """必要的環境變數缺少或無效。命令列入口會印出訊息並以狀態碼 1 結束，作為函式庫使用時由呼叫端處理。"""
+
+
+def load_env():
+    """從 .env 載入環境變數，只載入一次；已存在的系統環境變數不會被覆蓋。"""
+    global _env_loaded
+    if _env_loaded:
+        return
+    from dotenv import load_dotenv
+    load_dotenv()
+    _env_loaded = True
+
+
+def require_env(*names: str) -> dict:
+    """回傳 {變數名稱: 值}；任何一個未設定時拋出 ConfigError，列出所有缺少的變數。"""
+    missing = [name for name in names if not os.getenv(name)]
+    if missing:
+        raise ConfigError(f"請在 .env 文件或系統環境變數中設定：{', '.join(missing)}")
+    return {name: os.getenv(name) for name in names}
+
+
+def telegram_api_credentials() -> tuple[int, str]:
+    values = require_env("TELEGRAM_API_ID", "TELEGRAM_API_HASH")
+    try:
+        api_id = int(values["TELEGRAM_API_ID"])
+    except ValueError:
+        raise ConfigError("TELEGRAM_API_ID 必須是有效的數字。請檢查 .env 文件或環境變數中的值。") from None
+    return api_id, values["TELEGRAM_API_HASH"]
+
+
+def restore_session(session_name: str = SESSION_NAME):
+    """
+    若設定了 TELETHON_SESSION 環境變數（base64 編碼的 session 檔），將它還原為 <session_name>.session，
+    適合於容器化部署與 GitHub Actions。未設定時沿用現有的 session 檔案。
+    """
+    encoded_session = os.getenv("TELETHON_SESSION")
+    if not encoded_session:
+        print(f"未檢測到 TELETHON_SESSION 環境變數，將嘗試使用現有的 {session_name}.session 檔案。")
+        print(f"如果 {session_name}.session 不存在或無效，Telethon 可能會要求您登錄。")
+        return
+    print(f"檢測到 TELETHON_SESSION 環境變數，正在解碼並還原 {session_name}.session 檔案...")
+    try:
+        session_bytes = base64.b64decode(encoded_session)
+        with open(f"{session_name}.session", "wb") as f:
+            f.write(session_bytes)
+    except Exception as e:
+        raise ConfigError(f"還原 {session_name}.session 檔案失敗: {e}。"
+                          "請確保 TELETHON_SESSION 環境變數包含有效的 base64 編碼字串。") from e
+    print(f"{session_name}.session 檔案還原成功。")
+
+
+def create_telegram_client(session_name: str = SESSION_NAME):
+    """
+    建立（但不連線）Telethon 客戶端。
+    傳遞的 API_ID 和 API_HASH 必須與生成 session 檔時所用的憑證匹配，否則 Telethon 會嘗試重新登入（需要電話驗證）。
+    """
+    api_id, api_hash = telegram_api_credentials()
+    restore_session(session_name)
+    from telethon import TelegramClient
+    return TelegramClient(session_name, api_id, api_hash)